@@ -1,14 +1,17 @@
 import os
+import hashlib
 import logging
+import sqlite3
 from typing import List, Optional
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+import orjson
 import uvicorn
 from contextlib import asynccontextmanager
 
-from services.document_processor import DocumentProcessor
+from services.document_processor import DocumentProcessor, SUPPORTED_EXTENSIONS
 from services.vector_store import VectorStore
 from services.llm_service import LLMService
 from services.database import DatabaseService
@@ -20,6 +23,8 @@ logger = logging.getLogger(__name__)
 
 # Pydantic models
 class QueryRequest(BaseModel):
+    model_config = ConfigDict(str_max_length=10_000)
+    
     query: str
     top_k: Optional[int] = 5
 
@@ -36,6 +41,8 @@ class DocumentMetadata(BaseModel):
     upload_date: str
     document_id: str
 
+NO_RESULTS_ANSWER = "I couldn't find any relevant information in the uploaded documents."
+
 # Global services
 document_processor = None
 vector_store = None
@@ -68,13 +75,31 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down services...")
+    await llm_service.aclose()
+    await db_service.close()
+    document_processor.close()
+    vector_store.close()
+
+# Dependency getters; tests swap the services through app.dependency_overrides
+def get_document_processor() -> DocumentProcessor:
+    return document_processor
+
+def get_vector_store() -> VectorStore:
+    return vector_store
+
+def get_llm_service() -> LLMService:
+    return llm_service
+
+def get_db_service() -> DatabaseService:
+    return db_service
 
 # Create FastAPI app
 app = FastAPI(
     title="RAG Pipeline API",
     description="A Retrieval-Augmented Generation pipeline for document Q&A",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -95,31 +120,54 @@ async def health_check():
     return {"status": "healthy", "services": "operational"}
 
 @app.post("/upload", response_model=dict)
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(
+    file: UploadFile = File(...),
+    document_processor: DocumentProcessor = Depends(get_document_processor),
+    vector_store: VectorStore = Depends(get_vector_store),
+    db_service: DatabaseService = Depends(get_db_service)
+):
     """Upload and process a document"""
     try:
         # Validate file
         if not file.filename:
             raise HTTPException(status_code=400, detail="No file provided")
         
-        # Check file size (max 50MB)
-        content = await file.read()
-        if len(content) > 50 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File too large (max 50MB)")
-        
-        # Check file type
-        allowed_types = ['.pdf', '.txt', '.docx', '.md']
-        if not any(file.filename.lower().endswith(ext) for ext in allowed_types):
+        # Check file type before reading any of the body
+        file_extension = os.path.splitext(file.filename)[1].lower()
+        if file_extension not in SUPPORTED_EXTENSIONS:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Unsupported file type. Allowed: {', '.join(allowed_types)}"
+                detail=f"Unsupported file type. Allowed: {', '.join(sorted(SUPPORTED_EXTENSIONS))}"
             )
         
+        # Starlette has already spooled the whole body to a temporary file by
+        # the time this runs, so the limit caps what is processed rather than
+        # what is received. The file is measured and hashed in place
+        max_file_size = Config.MAX_FILE_SIZE_MB * 1024 * 1024
+        if file.size is not None and file.size > max_file_size:
+            raise _file_too_large()
+        
+        file_size = 0
+        content_hash = hashlib.sha256()
+        while chunk := await file.read(1024 * 1024):
+            file_size += len(chunk)
+            if file_size > max_file_size:
+                raise _file_too_large()
+            content_hash.update(chunk)
+        await file.seek(0)
+        
+        # Identical content was already processed, so skip re-embedding it
+        existing = await db_service.get_document_by_hash(content_hash.hexdigest())
+        if existing:
+            logger.info(f"Skipping duplicate upload {file.filename} of {existing['document_id']}")
+            return _duplicate_response(existing)
+        
         logger.info(f"Processing file: {file.filename}")
         
-        # Process document
-        document_id, chunks = await document_processor.process_document(
-            content, file.filename
+        # Parsers read the spooled upload directly, so uploads that spilled
+        # to disk are never loaded into memory as a whole
+        document_id, chunks, page_count = await document_processor.process_document(
+            file.file, file.filename
         )
         
         # Store in vector database
@@ -129,12 +177,25 @@ async def upload_document(file: UploadFile = File(...)):
         metadata = {
             'document_id': document_id,
             'filename': file.filename,
-            'file_size': len(content),
+            'file_size': file_size,
             'chunks': len(chunks),
-            'pages': await document_processor.get_page_count(content, file.filename)
+            'pages': page_count,
+            'content_hash': content_hash.hexdigest()
         }
         
-        await db_service.store_document_metadata(metadata)
+        try:
+            await db_service.store_document_metadata(metadata)
+        except sqlite3.IntegrityError:
+            # A concurrent upload of the same content claimed the hash first,
+            # so drop the chunks embedded here and report that document
+            existing = await db_service.get_document_by_hash(content_hash.hexdigest())
+            if not existing:
+                raise
+            await vector_store.delete_document(document_id)
+            logger.info(f"Discarded concurrent duplicate upload {file.filename} of {existing['document_id']}")
+            return _duplicate_response(existing)
+        
+        await db_service.store_chunks_metadata(chunks)
         
         logger.info(f"Successfully processed {file.filename}: {len(chunks)} chunks")
         
@@ -145,12 +206,51 @@ async def upload_document(file: UploadFile = File(...)):
             "chunks_created": len(chunks)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _file_too_large() -> HTTPException:
+    """Build the error for uploads over the size limit"""
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large (max {Config.MAX_FILE_SIZE_MB}MB)"
+    )
+
+def _duplicate_response(existing: dict) -> dict:
+    """Build the upload response for content that is already stored"""
+    return {
+        "message": "Document already uploaded",
+        "document_id": existing['document_id'],
+        "filename": existing['filename'],
+        "chunks_created": 0
+    }
+
+def _format_sources(relevant_chunks: List[dict]) -> List[dict]:
+    """Format retrieved chunks as response sources"""
+    return [
+        {
+            "document_id": chunk.get("document_id"),
+            "filename": chunk.get("filename"),
+            "page": chunk.get("page", "Unknown"),
+            "similarity_score": chunk.get("score", 0.0),
+            "preview": _preview(chunk.get("content") or "")
+        }
+        for chunk in relevant_chunks
+    ]
+
+def _preview(content: str, length: int = 200) -> str:
+    """Truncate content for display, marking it only when something was cut"""
+    return content if len(content) <= length else content[:length] + "..."
+
 @app.post("/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+async def query_documents(
+    request: QueryRequest,
+    vector_store: VectorStore = Depends(get_vector_store),
+    llm_service: LLMService = Depends(get_llm_service)
+):
     """Query the document collection"""
     try:
         logger.info(f"Processing query: {request.query}")
@@ -160,7 +260,7 @@ async def query_documents(request: QueryRequest):
         
         if not relevant_chunks:
             return QueryResponse(
-                answer="I couldn't find any relevant information in the uploaded documents.",
+                answer=NO_RESULTS_ANSWER,
                 sources=[],
                 query=request.query
             )
@@ -168,20 +268,9 @@ async def query_documents(request: QueryRequest):
         # Generate response using LLM
         answer = await llm_service.generate_response(request.query, relevant_chunks)
         
-        # Format sources
-        sources = []
-        for chunk in relevant_chunks:
-            sources.append({
-                "document_id": chunk.get("document_id"),
-                "filename": chunk.get("filename"),
-                "page": chunk.get("page", "Unknown"),
-                "similarity_score": chunk.get("score", 0.0),
-                "preview": chunk.get("content", "")[:200] + "..."
-            })
-        
         return QueryResponse(
             answer=answer,
-            sources=sources,
+            sources=_format_sources(relevant_chunks),
             query=request.query
         )
         
@@ -189,18 +278,56 @@ async def query_documents(request: QueryRequest):
         logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def query_documents_stream(
+    request: QueryRequest,
+    vector_store: VectorStore = Depends(get_vector_store),
+    llm_service: LLMService = Depends(get_llm_service)
+):
+    """Query the document collection, streaming the answer as server-sent events"""
+    try:
+        logger.info(f"Processing streaming query: {request.query}")
+        
+        # Retrieve relevant chunks
+        relevant_chunks = await vector_store.search(request.query, request.top_k)
+        
+    except Exception as e:
+        logger.error(f"Error processing query: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        # Sources are known before generation starts, so they are sent first
+        yield b"event: sources\ndata: " + orjson.dumps(_format_sources(relevant_chunks)) + b"\n\n"
+        
+        if not relevant_chunks:
+            yield b"data: " + orjson.dumps(NO_RESULTS_ANSWER) + b"\n\n"
+        else:
+            # Tokens are JSON-encoded so embedded newlines cannot break framing
+            async for token in llm_service.generate_response_stream(request.query, relevant_chunks):
+                yield b"data: " + orjson.dumps(token) + b"\n\n"
+        
+        yield b"event: done\ndata: [DONE]\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/documents", response_model=List[DocumentMetadata])
-async def get_documents():
+async def get_documents(db_service: DatabaseService = Depends(get_db_service)):
     """Get all uploaded document metadata"""
     try:
         documents = await db_service.get_all_documents()
-        return documents
+        # Rows come from our own database, so skip re-validating them against
+        # the response model; it still documents the schema
+        return ORJSONResponse(documents)
     except Exception as e:
         logger.error(f"Error retrieving documents: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/documents/{document_id}")
-async def delete_document(document_id: str):
+async def delete_document(
+    document_id: str,
+    vector_store: VectorStore = Depends(get_vector_store),
+    db_service: DatabaseService = Depends(get_db_service)
+):
     """Delete a document and its chunks"""
     try:
         # Remove from vector store
@@ -216,7 +343,7 @@ async def delete_document(document_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/stats")
-async def get_stats():
+async def get_stats(db_service: DatabaseService = Depends(get_db_service)):
     """Get system statistics"""
     try:
         stats = await db_service.get_stats()
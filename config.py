@@ -9,6 +9,8 @@ class Config:
     # Embedding Configuration (using free sentence-transformers)
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
     EMBEDDING_DIMENSION: int = int(os.getenv("EMBEDDING_DIMENSION", "384"))
+    # Device for the encoder ("cuda", "cpu", ...); empty picks CUDA when available
+    EMBEDDING_DEVICE: str = os.getenv("EMBEDDING_DEVICE", "")
     
     # Vector Store Configuration
     VECTOR_STORE_PATH: str = os.getenv("VECTOR_STORE_PATH", "./data/vector_store")
@@ -31,6 +33,8 @@ class Config:
     # Retrieval Configuration
     DEFAULT_TOP_K: int = int(os.getenv("DEFAULT_TOP_K", "5"))
     SIMILARITY_THRESHOLD: float = float(os.getenv("SIMILARITY_THRESHOLD", "0.7"))
+    # Stores with at least this many chunks are searched through an HNSW index
+    ANN_INDEX_THRESHOLD: int = int(os.getenv("ANN_INDEX_THRESHOLD", "10000"))
     
     # Data Directory
     DATA_DIR: str = os.getenv("DATA_DIR", "./data")
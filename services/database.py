@@ -1,8 +1,7 @@
 import aiosqlite
 import logging
-import json
 from typing import List, Dict, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 
 from config import Config
@@ -14,90 +13,150 @@ class DatabaseService:
         self.db_path = Config.DATABASE_URL.replace("sqlite:///", "")
         # Ensure the directory exists
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._db: Optional[aiosqlite.Connection] = None
     
     async def initialize(self):
         """Initialize the database with required tables"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Create documents table
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS documents (
-                        id TEXT PRIMARY KEY,
-                        filename TEXT NOT NULL,
-                        file_size INTEGER NOT NULL,
-                        pages INTEGER NOT NULL,
-                        chunks INTEGER NOT NULL,
-                        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Create queries table for analytics
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS queries (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        query_text TEXT NOT NULL,
-                        response_time REAL,
-                        chunks_retrieved INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                await db.commit()
-                logger.info("Database initialized successfully")
-                
+            # Open the long-lived connection shared by all queries
+            self._db = await aiosqlite.connect(self.db_path)
+            db = self._db
+            db.row_factory = aiosqlite.Row
+            
+            # WAL lets readers proceed while a write is in progress
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("PRAGMA synchronous=NORMAL")
+            await db.execute("PRAGMA temp_store=MEMORY")
+            
+            # Create documents table
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    pages INTEGER NOT NULL,
+                    chunks INTEGER NOT NULL,
+                    content_hash TEXT,
+                    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Add the content hash column to databases created before deduplication
+            cursor = await db.execute("PRAGMA table_info(documents)")
+            columns = {row['name'] async for row in cursor}
+            if 'content_hash' not in columns:
+                await db.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+            
+            # Create queries table for analytics
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS queries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    query_text TEXT NOT NULL,
+                    response_time REAL,
+                    chunks_retrieved INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Create chunks table for per-chunk metadata
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id TEXT PRIMARY KEY,
+                    document_id TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Index the columns used for ordering documents and windowing queries
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_documents_upload_date
+                ON documents(upload_date DESC)
+            """)
+            await db.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_content_hash
+                ON documents(content_hash)
+            """)
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_queries_created_at
+                ON queries(created_at)
+            """)
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chunks_document_id
+                ON chunks(document_id)
+            """)
+            
+            await db.commit()
+            logger.info("Database initialized successfully")
+            
         except Exception as e:
             logger.error(f"Error initializing database: {str(e)}")
             raise
     
+    async def close(self):
+        """Close the database connection"""
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+    
     async def store_document_metadata(self, metadata: Dict):
         """Store document metadata"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    INSERT INTO documents (id, filename, file_size, pages, chunks, upload_date)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    metadata['document_id'],
-                    metadata['filename'],
-                    metadata['file_size'],
-                    metadata['pages'],
-                    metadata['chunks'],
-                    datetime.utcnow().isoformat()
-                ))
-                
-                await db.commit()
-                logger.info(f"Stored metadata for document: {metadata['filename']}")
-                
+            db = self._db
+            await db.execute("""
+                INSERT INTO documents (id, filename, file_size, pages, chunks, content_hash, upload_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (
+                metadata['document_id'],
+                metadata['filename'],
+                metadata['file_size'],
+                metadata['pages'],
+                metadata['chunks'],
+                metadata.get('content_hash'),
+                datetime.utcnow().isoformat()
+            ))
+            
+            await db.commit()
+            logger.info(f"Stored metadata for document: {metadata['filename']}")
+            
         except Exception as e:
             logger.error(f"Error storing document metadata: {str(e)}")
             raise
     
+    async def store_chunks_metadata(self, chunks: List[Dict]):
+        """Store chunk metadata in a single transaction"""
+        try:
+            db = self._db
+            await db.executemany("""
+                INSERT INTO chunks (id, document_id, chunk_index, length)
+                VALUES (?, ?, ?, ?)
+            """, [
+                (chunk['id'], chunk['document_id'], chunk['chunk_index'], chunk['length'])
+                for chunk in chunks
+            ])
+            
+            # A single commit amortizes the sync over the whole batch
+            await db.commit()
+            logger.info(f"Stored metadata for {len(chunks)} chunks")
+            
+        except Exception as e:
+            logger.error(f"Error storing chunk metadata: {str(e)}")
+            raise
+    
     async def get_all_documents(self) -> List[Dict]:
         """Get all document metadata"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute("""
-                    SELECT id, filename, file_size, pages, chunks, upload_date
-                    FROM documents
-                    ORDER BY upload_date DESC
-                """)
-                
-                rows = await cursor.fetchall()
-                
-                documents = []
-                for row in rows:
-                    documents.append({
-                        'document_id': row[0],
-                        'filename': row[1],
-                        'file_size': row[2],
-                        'pages': row[3],
-                        'chunks': row[4],
-                        'upload_date': row[5]
-                    })
-                
-                return documents
-                
+            db = self._db
+            cursor = await db.execute("""
+                SELECT id AS document_id, filename, file_size, pages, chunks, upload_date
+                FROM documents
+                ORDER BY upload_date DESC
+            """)
+            
+            return [dict(row) async for row in cursor]
+            
         except Exception as e:
             logger.error(f"Error getting documents: {str(e)}")
             return []
@@ -105,42 +164,53 @@ class DatabaseService:
     async def get_document_by_id(self, document_id: str) -> Optional[Dict]:
         """Get document metadata by ID"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute("""
-                    SELECT id, filename, file_size, pages, chunks, upload_date
-                    FROM documents
-                    WHERE id = ?
-                """, (document_id,))
-                
-                row = await cursor.fetchone()
-                
-                if row:
-                    return {
-                        'document_id': row[0],
-                        'filename': row[1],
-                        'file_size': row[2],
-                        'pages': row[3],
-                        'chunks': row[4],
-                        'upload_date': row[5]
-                    }
-                
-                return None
-                
+            db = self._db
+            cursor = await db.execute("""
+                SELECT id AS document_id, filename, file_size, pages, chunks, upload_date
+                FROM documents
+                WHERE id = ?
+            """, (document_id,))
+            
+            row = await cursor.fetchone()
+            
+            return dict(row) if row else None
+            
         except Exception as e:
             logger.error(f"Error getting document by ID: {str(e)}")
             return None
     
+    async def get_document_by_hash(self, content_hash: str) -> Optional[Dict]:
+        """Get document metadata by SHA-256 content hash"""
+        try:
+            db = self._db
+            cursor = await db.execute("""
+                SELECT id AS document_id, filename, file_size, pages, chunks, upload_date
+                FROM documents
+                WHERE content_hash = ?
+            """, (content_hash,))
+            
+            row = await cursor.fetchone()
+            
+            return dict(row) if row else None
+            
+        except Exception as e:
+            logger.error(f"Error getting document by hash: {str(e)}")
+            return None
+    
     async def delete_document(self, document_id: str):
         """Delete document metadata"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    DELETE FROM documents WHERE id = ?
-                """, (document_id,))
-                
-                await db.commit()
-                logger.info(f"Deleted document metadata: {document_id}")
-                
+            db = self._db
+            await db.execute("""
+                DELETE FROM documents WHERE id = ?
+            """, (document_id,))
+            await db.execute("""
+                DELETE FROM chunks WHERE document_id = ?
+            """, (document_id,))
+            
+            await db.commit()
+            logger.info(f"Deleted document metadata: {document_id}")
+            
         except Exception as e:
             logger.error(f"Error deleting document: {str(e)}")
             raise
@@ -148,14 +218,14 @@ class DatabaseService:
     async def log_query(self, query_text: str, response_time: float, chunks_retrieved: int):
         """Log query for analytics"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    INSERT INTO queries (query_text, response_time, chunks_retrieved)
-                    VALUES (?, ?, ?)
-                """, (query_text, response_time, chunks_retrieved))
-                
-                await db.commit()
-                
+            db = self._db
+            await db.execute("""
+                INSERT INTO queries (query_text, response_time, chunks_retrieved)
+                VALUES (?, ?, ?)
+            """, (query_text, response_time, chunks_retrieved))
+            
+            await db.commit()
+            
         except Exception as e:
             logger.error(f"Error logging query: {str(e)}")
             # Don't raise here as it's not critical
@@ -163,46 +233,39 @@ class DatabaseService:
     async def get_stats(self) -> Dict:
         """Get system statistics"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Get document stats
-                cursor = await db.execute("""
-                    SELECT 
-                        COUNT(*) as total_documents,
-                        SUM(file_size) as total_size,
-                        SUM(pages) as total_pages,
-                        SUM(chunks) as total_chunks,
-                        AVG(file_size) as avg_file_size
-                    FROM documents
-                """)
-                doc_stats = await cursor.fetchone()
-                
-                # Get query stats
-                cursor = await db.execute("""
-                    SELECT 
-                        COUNT(*) as total_queries,
-                        AVG(response_time) as avg_response_time,
-                        AVG(chunks_retrieved) as avg_chunks_retrieved
-                    FROM queries
-                    WHERE created_at >= datetime('now', '-30 days')
-                """)
-                query_stats = await cursor.fetchone()
-                
-                return {
-                    'documents': {
-                        'total': doc_stats[0] or 0,
-                        'total_size_bytes': doc_stats[1] or 0,
-                        'total_pages': doc_stats[2] or 0,
-                        'total_chunks': doc_stats[3] or 0,
-                        'average_file_size_bytes': doc_stats[4] or 0
-                    },
-                    'queries_last_30_days': {
-                        'total': query_stats[0] or 0,
-                        'average_response_time_seconds': query_stats[1] or 0,
-                        'average_chunks_retrieved': query_stats[2] or 0
-                    },
-                    'generated_at': datetime.utcnow().isoformat()
-                }
-                
+            db = self._db
+            # Get document stats
+            cursor = await db.execute("""
+                SELECT 
+                    COUNT(*) AS total,
+                    SUM(file_size) AS total_size_bytes,
+                    SUM(pages) AS total_pages,
+                    SUM(chunks) AS total_chunks,
+                    AVG(file_size) AS average_file_size_bytes
+                FROM documents
+            """)
+            doc_stats = await cursor.fetchone()
+            
+            # Get query stats, bounding created_at by a literal so the index applies
+            # (CURRENT_TIMESTAMP stores UTC as 'YYYY-MM-DD HH:MM:SS')
+            cutoff = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+            cursor = await db.execute("""
+                SELECT 
+                    COUNT(*) AS total,
+                    AVG(response_time) AS average_response_time_seconds,
+                    AVG(chunks_retrieved) AS average_chunks_retrieved
+                FROM queries
+                WHERE created_at >= ?
+            """, (cutoff,))
+            query_stats = await cursor.fetchone()
+            
+            # Aggregates over empty tables come back as NULL
+            return {
+                'documents': {key: value or 0 for key, value in dict(doc_stats).items()},
+                'queries_last_30_days': {key: value or 0 for key, value in dict(query_stats).items()},
+                'generated_at': datetime.utcnow().isoformat()
+            }
+            
         except Exception as e:
             logger.error(f"Error getting stats: {str(e)}")
             return {
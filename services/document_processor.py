@@ -1,9 +1,13 @@
+import asyncio
+import os
+import threading
 import uuid
 import logging
-from typing import List, Dict, Tuple
-import PyPDF2
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, BinaryIO
+import pypdfium2 as pdfium
 import docx
-from io import BytesIO
+import numpy as np
 import re
 from datetime import datetime
 
@@ -11,142 +15,170 @@ from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Page markers are dropped; whitespace runs and special characters become a space
+_CLEAN_RE = re.compile(r'(?P<page>--- Page \d+ ---)|\s+|[^\w\s\.\,\;\:\!\?\-\(\)]')
+_SENTENCE_RE = re.compile(r'[^.!?]+[.!?]*')
+
+SUPPORTED_EXTENSIONS = frozenset({'.pdf', '.txt', '.docx', '.md'})
+
+# PDFium is not thread-safe, so calls into it are serialized process-wide
+_PDFIUM_LOCK = threading.Lock()
+
 class DocumentProcessor:
     def __init__(self):
         self.chunk_size = Config.CHUNK_SIZE
         self.chunk_overlap = Config.CHUNK_OVERLAP
+        self._pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        
+        # Text extractors keyed by lower-cased file extension
+        self._extractors = {
+            '.pdf': self._extract_pdf_text,
+            '.docx': self._extract_docx_text,
+            '.txt': self._extract_plain_text,
+            '.md': self._extract_plain_text
+        }
+    
+    def close(self):
+        """Shut down the processing thread pool"""
+        self._pool.shutdown(wait=False)
     
-    async def process_document(self, content: bytes, filename: str) -> Tuple[str, List[Dict]]:
-        """Process a document and return document ID and chunks"""
+    async def process_document(self, source: BinaryIO, filename: str) -> Tuple[str, List[Dict], int]:
+        """Process a document and return document ID, chunks and page count"""
         document_id = str(uuid.uuid4())
         
-        # Extract text based on file type
-        text = await self._extract_text(content, filename)
+        # Parsing and chunking are CPU-bound, so both run on the pool to keep
+        # the event loop free for other requests
+        loop = asyncio.get_running_loop()
+        
+        # Extract text and count pages in a single parse
+        text, page_count = await loop.run_in_executor(self._pool, self._extract_text, source, filename)
         
         if not text.strip():
             raise ValueError("No text content found in document")
         
         # Split into chunks
-        chunks = self._create_chunks(text, document_id, filename)
+        chunks = await loop.run_in_executor(self._pool, self._create_chunks, text, document_id, filename)
         
         logger.info(f"Processed {filename}: {len(chunks)} chunks created")
-        return document_id, chunks
+        return document_id, chunks, page_count
     
-    async def _extract_text(self, content: bytes, filename: str) -> str:
-        """Extract text from different file types"""
-        file_extension = filename.lower().split('.')[-1]
+    def _extract_text(self, source: BinaryIO, filename: str) -> Tuple[str, int]:
+        """Extract text and page count from different file types"""
+        file_extension = os.path.splitext(filename)[1].lower()
         
         try:
-            if file_extension == 'pdf':
-                return self._extract_pdf_text(content)
-            elif file_extension == 'docx':
-                return self._extract_docx_text(content)
-            elif file_extension in ['txt', 'md']:
-                return content.decode('utf-8')
-            else:
+            extractor = self._extractors.get(file_extension)
+            if extractor is None:
                 raise ValueError(f"Unsupported file type: {file_extension}")
+            return extractor(source)
         except Exception as e:
             logger.error(f"Error extracting text from {filename}: {str(e)}")
             raise ValueError(f"Failed to extract text from {filename}: {str(e)}")
     
-    def _extract_pdf_text(self, content: bytes) -> str:
-        """Extract text from PDF"""
-        text = ""
+    def _extract_pdf_text(self, source: BinaryIO) -> Tuple[str, int]:
+        """Extract text and page count from PDF"""
+        text_parts = []
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(content))
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                if page_text.strip():
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
+            with _PDFIUM_LOCK:
+                pdf = pdfium.PdfDocument(source)
+                try:
+                    page_count = len(pdf)
+                    for page_num, page in enumerate(pdf):
+                        textpage = page.get_textpage()
+                        page_text = textpage.get_text_range()
+                        textpage.close()
+                        page.close()
+                        if page_text.strip():
+                            text_parts.append(f"\n--- Page {page_num + 1} ---\n{page_text}\n")
+                finally:
+                    pdf.close()
         except Exception as e:
             logger.error(f"Error reading PDF: {str(e)}")
             raise ValueError(f"Failed to read PDF: {str(e)}")
         
-        return text
+        return "".join(text_parts), page_count
     
-    def _extract_docx_text(self, content: bytes) -> str:
-        """Extract text from DOCX"""
+    def _extract_docx_text(self, source: BinaryIO) -> Tuple[str, int]:
+        """Extract text and estimated page count from DOCX"""
         try:
-            doc = docx.Document(BytesIO(content))
+            doc = docx.Document(source)
             text = ""
+            total_chars = 0
             for paragraph in doc.paragraphs:
+                total_chars += len(paragraph.text)
                 if paragraph.text.strip():
                     text += paragraph.text + "\n"
-            return text
+            return text, self._estimate_page_count(total_chars)
         except Exception as e:
             logger.error(f"Error reading DOCX: {str(e)}")
             raise ValueError(f"Failed to read DOCX: {str(e)}")
     
+    def _extract_plain_text(self, source: BinaryIO) -> Tuple[str, int]:
+        """Extract text and estimated page count from TXT/MD"""
+        text = source.read().decode('utf-8')
+        return text, self._estimate_page_count(len(text))
+    
+    def _estimate_page_count(self, char_count: int) -> int:
+        """Estimate pages for formats without real pagination"""
+        # Rough estimate: 2000 characters per page
+        return max(1, char_count // 2000)
+    
     def _create_chunks(self, text: str, document_id: str, filename: str) -> List[Dict]:
-        """Split text into overlapping chunks"""
+        """Split text into overlapping chunks of whole sentences"""
         chunks = []
         
         # Clean text
         text = self._clean_text(text)
         
-        # Split into sentences for better chunking
-        sentences = self._split_into_sentences(text)
-        
-        current_chunk = ""
-        current_length = 0
-        chunk_index = 0
+        # Sentence offsets double as prefix sums of sentence lengths, so chunk
+        # boundaries can be found by binary search instead of concatenation
+        starts, ends = self._split_into_sentences(text)
+        sentence_count = len(starts)
         
-        for sentence in sentences:
-            sentence_length = len(sentence)
+        first = 0
+        while first < sentence_count:
+            last = self._last_sentence(starts, ends, first)
             
-            # If adding this sentence would exceed chunk size, save current chunk
-            if current_length + sentence_length > self.chunk_size and current_chunk:
+            content = text[starts[first]:ends[last]].strip()
+            if content:
                 chunks.append(self._create_chunk_dict(
-                    current_chunk.strip(),
+                    content,
                     document_id,
                     filename,
-                    chunk_index
+                    len(chunks)
                 ))
-                
-                # Start new chunk with overlap
-                overlap_text = self._get_overlap_text(current_chunk, self.chunk_overlap)
-                current_chunk = overlap_text + " " + sentence
-                current_length = len(current_chunk)
-                chunk_index += 1
-            else:
-                current_chunk += " " + sentence
-                current_length += sentence_length
-        
-        # Add the last chunk if it has content
-        if current_chunk.strip():
-            chunks.append(self._create_chunk_dict(
-                current_chunk.strip(),
-                document_id,
-                filename,
-                chunk_index
-            ))
+            
+            if last == sentence_count - 1:
+                break
+            
+            # Start the next chunk with the sentences inside the overlap window
+            overlap_start = int(np.searchsorted(starts, ends[last] - self.chunk_overlap, side='left'))
+            first = max(overlap_start, first + 1)
+            
+            # When the next sentence does not fit after the overlap, that chunk
+            # would only repeat the tail of this one, so start after it instead
+            if self._last_sentence(starts, ends, first) <= last:
+                first = last + 1
         
         return chunks
     
+    def _last_sentence(self, starts: np.ndarray, ends: np.ndarray, first: int) -> int:
+        """Find the last sentence that still fits into a chunk beginning at `first`"""
+        last = int(np.searchsorted(ends, starts[first] + self.chunk_size, side='right')) - 1
+        return max(last, first)
+    
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove special characters that might cause issues
-        text = re.sub(r'[^\w\s\.\,\;\:\!\?\-\(\)]', ' ', text)
-        
-        # Remove page markers
-        text = re.sub(r'--- Page \d+ ---', '', text)
-        
+        text = _CLEAN_RE.sub(lambda match: '' if match.lastgroup == 'page' else ' ', text)
         return text.strip()
     
-    def _split_into_sentences(self, text: str) -> List[str]:
-        """Split text into sentences"""
-        # Simple sentence splitting
-        sentences = re.split(r'[.!?]+', text)
-        return [s.strip() for s in sentences if s.strip()]
-    
-    def _get_overlap_text(self, text: str, overlap_size: int) -> str:
-        """Get the last N characters for overlap"""
-        if len(text) <= overlap_size:
-            return text
-        return text[-overlap_size:]
+    def _split_into_sentences(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Locate sentences as arrays of start and end character offsets"""
+        offsets = np.fromiter(
+            (offset for match in _SENTENCE_RE.finditer(text) for offset in match.span()),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        return offsets[:, 0], offsets[:, 1]
     
     def _create_chunk_dict(self, content: str, document_id: str, filename: str, chunk_index: int) -> Dict:
         """Create a chunk dictionary"""
@@ -159,26 +191,3 @@ class DocumentProcessor:
             'length': len(content),
             'created_at': datetime.utcnow().isoformat()
         }
-    
-    async def get_page_count(self, content: bytes, filename: str) -> int:
-        """Get the number of pages in a document"""
-        file_extension = filename.lower().split('.')[-1]
-        
-        try:
-            if file_extension == 'pdf':
-                pdf_reader = PyPDF2.PdfReader(BytesIO(content))
-                return len(pdf_reader.pages)
-            elif file_extension == 'docx':
-                # For DOCX, estimate based on content length
-                doc = docx.Document(BytesIO(content))
-                total_chars = sum(len(p.text) for p in doc.paragraphs)
-                # Rough estimate: 2000 characters per page
-                return max(1, total_chars // 2000)
-            else:
-                # For text files, estimate based on content length
-                text = content.decode('utf-8')
-                # Rough estimate: 2000 characters per page
-                return max(1, len(text) // 2000)
-        except Exception as e:
-            logger.error(f"Error counting pages: {str(e)}")
-            return 1  # Default to 1 page if we can't determine
\ No newline at end of file
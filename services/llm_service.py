@@ -1,6 +1,7 @@
 import logging
-from typing import List, Dict
+from typing import List, Dict, AsyncIterator
 import httpx
+import orjson
 from datetime import datetime
 
 from config import Config
@@ -15,9 +16,30 @@ class LLMService:
         
         if not self.api_key:
             raise ValueError("GROQ_API_KEY is required")
+        
+        # Reuse one client so queries share pooled, multiplexed HTTP/2 connections
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=True,
+            timeout=30.0,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        )
+    
+    async def aclose(self):
+        """Close the underlying HTTP client"""
+        await self._client.aclose()
     
     async def generate_response(self, query: str, relevant_chunks: List[Dict]) -> str:
-        """Generate a response using Groq API with retrieved context"""
+        """Generate a complete response using Groq API with retrieved context"""
+        tokens = [token async for token in self.generate_response_stream(query, relevant_chunks)]
+        return "".join(tokens).strip()
+    
+    async def generate_response_stream(self, query: str, relevant_chunks: List[Dict]) -> AsyncIterator[str]:
+        """Stream a response from Groq API token by token"""
         try:
             # Prepare context from relevant chunks
             context = self._prepare_context(relevant_chunks)
@@ -25,14 +47,13 @@ class LLMService:
             # Create the prompt
             prompt = self._create_prompt(query, context)
             
-            # Call Groq API
-            response = await self._call_groq_api(prompt)
-            
-            return response
+            # Stream from Groq API
+            async for token in self._stream_groq_api(prompt):
+                yield token
             
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
-            return f"I apologize, but I encountered an error while generating a response: {str(e)}"
+            yield f"I apologize, but I encountered an error while generating a response: {str(e)}"
     
     def _prepare_context(self, chunks: List[Dict]) -> str:
         """Prepare context from retrieved chunks"""
@@ -72,13 +93,8 @@ RESPONSE:"""
         
         return prompt
     
-    async def _call_groq_api(self, prompt: str) -> str:
-        """Make API call to Groq"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+    async def _stream_groq_api(self, prompt: str) -> AsyncIterator[str]:
+        """Stream completion tokens from Groq as they are generated"""
         payload = {
             "model": self.model,
             "messages": [
@@ -90,39 +106,35 @@ RESPONSE:"""
             "temperature": 0.3,
             "max_tokens": 1000,
             "top_p": 0.9,
-            "stream": False
+            "stream": True
         }
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                
+            async with self._client.stream("POST", "/chat/completions", json=payload) as response:
                 if response.status_code != 200:
-                    error_msg = f"Groq API error: {response.status_code} - {response.text}"
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-                
-                result = response.json()
-                
-                if 'choices' not in result or len(result['choices']) == 0:
-                    error_msg = "Groq API response missing choices"
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-                
-                # Extract the content from the first choice
-                message = result['choices'][0]['message']
-                if 'content' not in message:
-                    error_msg = "Groq API response missing content in message"
+                    body = await response.aread()
+                    error_msg = f"Groq API error: {response.status_code} - {body.decode(errors='replace')}"
                     logger.error(error_msg)
                     raise Exception(error_msg)
                 
-                return message['content'].strip()
+                # Server-sent events: one "data: {json}" line per delta, ended by "data: [DONE]"
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    
+                    choices = orjson.loads(data).get('choices')
+                    if not choices:
+                        continue
+                    
+                    content = choices[0].get('delta', {}).get('content')
+                    if content:
+                        yield content
                 
         except httpx.HTTPError as e:
             error_msg = f"HTTP error occurred: {str(e)}"
             logger.error(error_msg)
-            raise Exception(error_msg)
\ No newline at end of file
+            raise Exception(error_msg)
@@ -1,96 +1,525 @@
+import asyncio
 import os
-import json
+import functools
+import threading
 import logging
+import sqlite3
+import faiss
 import numpy as np
-from typing import List, Dict, Optional
+import orjson
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, NamedTuple, Optional, Tuple
 from sentence_transformers import SentenceTransformer
+from threadpoolctl import threadpool_limits
 import pickle
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# HNSW graph degree and minimum search breadth
+_HNSW_M = 32
+_HNSW_EF_SEARCH = 64
+
+# Quantized index candidates fetched per requested result, then reranked exactly
+_RERANK_FACTOR = 4
+
+# The embedding file grows by this many preallocated rows at a time
+_GROWTH_ROWS = 65536
+
+# Metadata records looked up per query
+_METADATA_BATCH = 500
+
+# Deleted rows are compacted away once fewer than this share of rows is live
+_COMPACT_LIVE_RATIO = 0.5
+
+# The encoder is shared process-wide and its fast tokenizer fails on
+# concurrent calls, so encoding is serialized
+_ENCODER_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _get_encoder(model_name: str, device: str) -> SentenceTransformer:
+    """Load the sentence transformer once per process and share it between stores"""
+    model = SentenceTransformer(model_name, device=device)
+    # Encode on the GPU in half precision
+    if device.startswith('cuda'):
+        model.half()
+    return model
+
+class _SharedLock:
+    """Lock held by any number of readers at once or by a single writer"""
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def shared(self):
+        """Hold the lock alongside other readers"""
+        with self._condition:
+            # Waiting writers go first so a stream of readers cannot starve them
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+    
+    @contextmanager
+    def exclusive(self):
+        """Hold the lock alone"""
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+class _Snapshot(NamedTuple):
+    """Consistent view of the store that a search reads without holding the lock"""
+    embeddings: np.ndarray
+    alive: np.ndarray
+    row_ids: np.ndarray
+    live_count: int
+    index: Optional[faiss.Index]
+
 class VectorStore:
     def __init__(self):
-        self.model = SentenceTransformer(Config.EMBEDDING_MODEL)
+        # Encode on the GPU when one is available
+        device = Config.EMBEDDING_DEVICE or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = _get_encoder(Config.EMBEDDING_MODEL, device)
         self.vector_store_path = Config.VECTOR_STORE_PATH
-        self.embeddings_file = os.path.join(self.vector_store_path, "embeddings.pkl")
-        self.metadata_file = os.path.join(self.vector_store_path, "metadata.json")
+        self.header_file = os.path.join(self.vector_store_path, "header.json")
+        self.metadata_file = os.path.join(self.vector_store_path, "metadata.db")
+        self.index_file = os.path.join(self.vector_store_path, "index.faiss")
+        self.legacy_embeddings_file = os.path.join(self.vector_store_path, "embeddings.pkl")
+        self.legacy_metadata_file = os.path.join(self.vector_store_path, "metadata.json")
+        self.legacy_metadata_log_file = os.path.join(self.vector_store_path, "metadata.jsonl")
         
-        # Load existing data
-        self.embeddings = []
-        self.metadata = []
+        # Load existing data; embeddings live in a contiguous float32 buffer whose
+        # first _count rows are in use
+        self._embeddings = np.empty((0, Config.EMBEDDING_DIMENSION), dtype=np.float32)
+        self._count = 0
+        # Rows of deleted chunks stay in place, masked out of search, until compaction
+        self._alive = np.ones(0, dtype=bool)
+        self._deleted = 0
+        # Chunk metadata lives in SQLite and is fetched only for search hits;
+        # each row holds the ID of its metadata record, which stays fixed when
+        # compaction renumbers rows
+        self._row_ids = np.zeros(0, dtype=np.int64)
+        self._next_id = 0
+        self._metadata_db: Optional[sqlite3.Connection] = None
+        # Embedding indices of each document's chunks
+        self._doc_to_indices: Dict[str, List[int]] = defaultdict(list)
+        self._index: Optional[faiss.Index] = None
+        # Bumped by every compaction, which renumbers the rows; the header and
+        # the metadata database each record the generation they belong to
+        self._generation = 0
+        
+        # Writers serialize on _write_lock and never modify rows a snapshot can
+        # see: appends go past its end and deletes replace the alive mask.
+        # FAISS indexes can be searched concurrently but not while vectors are
+        # being added, so index access has its own shared lock. The metadata
+        # connection has a lock too, and only one search builds the index
+        self._write_lock = threading.Lock()
+        self._index_lock = _SharedLock()
+        self._db_lock = threading.Lock()
+        self._build_lock = threading.Lock()
         self._load_existing_data()
+        
+        # Cache recent query embeddings so repeated questions skip the encoder
+        self._encode_query = functools.lru_cache(maxsize=1024)(self._encode_query)
+        
+        # Searches run here, one per core, so NumPy's BLAS scores each search
+        # on a single thread to avoid oversubscription. The limit applies to
+        # the BLAS library only, leaving the encoder's torch threads alone
+        threadpool_limits(limits=1, user_api='blas')
+        self._search_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        # Inserts and deletes run off the event loop, one at a time
+        self._write_pool = ThreadPoolExecutor(max_workers=1)
+    
+    def close(self):
+        """Shut down the thread pools and the metadata connection"""
+        self._search_pool.shutdown(wait=False)
+        self._write_pool.shutdown(wait=True)
+        if self._metadata_db is not None:
+            self._metadata_db.close()
+            self._metadata_db = None
+    
+    @property
+    def embeddings_file(self) -> str:
+        """Path of the embedding file for the current generation"""
+        return self._embeddings_path(self._generation)
+    
+    def _embeddings_path(self, generation: int) -> str:
+        """Path of the embedding file for a compaction generation"""
+        # The first generation keeps the original name, so older stores load as is
+        if generation == 0:
+            return os.path.join(self.vector_store_path, "embeddings.npy")
+        return os.path.join(self.vector_store_path, f"embeddings.{generation}.npy")
+    
+    @property
+    def embeddings(self) -> np.ndarray:
+        """View of the stored embeddings, one row per chunk"""
+        return self._embeddings[:self._count]
+    
+    @property
+    def alive(self) -> np.ndarray:
+        """Mask of stored rows that have not been deleted"""
+        return self._alive[:self._count]
+    
+    @property
+    def row_ids(self) -> np.ndarray:
+        """Metadata record ID of each stored row, or -1 for rows without one"""
+        return self._row_ids[:self._count]
+    
+    @property
+    def live_count(self) -> int:
+        """Number of stored chunks that have not been deleted"""
+        return self._count - self._deleted
+    
+    def _append_embeddings(self, batch: np.ndarray, ids: np.ndarray):
+        """Append rows to the on-disk embedding buffer, growing it by whole blocks when full"""
+        needed = self._count + len(batch)
+        if needed > len(self._embeddings):
+            self._embeddings = self._write_embeddings(self.embeddings, needed, self.embeddings_file)
+            self._resize_row_state()
+        
+        self._embeddings[self._count:needed] = batch
+        self._embeddings.flush()
+        self._alive[self._count:needed] = True
+        self._row_ids[self._count:needed] = ids
+        self._count = needed
+    
+    def _resize_row_state(self):
+        """Resize the alive mask and row IDs to the embedding buffer's capacity"""
+        capacity = len(self._embeddings)
+        
+        alive = np.ones(capacity, dtype=bool)
+        alive[:self._count] = self.alive
+        self._alive = alive
+        
+        row_ids = np.full(capacity, -1, dtype=np.int64)
+        row_ids[:self._count] = self.row_ids
+        self._row_ids = row_ids
+    
+    def _write_embeddings(self, embeddings: np.ndarray, rows: int, path: str) -> np.memmap:
+        """Write embeddings to a new memory-mapped file with room for at least `rows` rows"""
+        capacity = -(-max(rows, 1) // _GROWTH_ROWS) * _GROWTH_ROWS
+        
+        # Build the file beside the live one and swap it in atomically, so a
+        # crash never leaves a half-written matrix
+        temp_file = path + ".tmp"
+        grown = np.lib.format.open_memmap(
+            temp_file,
+            mode='w+',
+            dtype=np.float32,
+            shape=(capacity, Config.EMBEDDING_DIMENSION)
+        )
+        grown[:len(embeddings)] = embeddings
+        grown.flush()
+        del grown
+        os.replace(temp_file, path)
+        
+        return np.load(path, mmap_mode='r+')
     
     def _load_existing_data(self):
         """Load existing embeddings and metadata"""
         try:
-            if os.path.exists(self.embeddings_file):
-                with open(self.embeddings_file, 'rb') as f:
-                    self.embeddings = pickle.load(f)
-                logger.info(f"Loaded {len(self.embeddings)} existing embeddings")
-            
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r') as f:
-                    self.metadata = json.load(f)
-                logger.info(f"Loaded {len(self.metadata)} existing metadata entries")
+            self._metadata_db = self._open_metadata_db()
+            
+            if os.path.exists(self.header_file):
+                with open(self.header_file, 'rb') as f:
+                    header = orjson.loads(f.read())
+                
+                if header['dim'] != Config.EMBEDDING_DIMENSION:
+                    raise ValueError(f"Stored embedding dimension {header['dim']} does not match configured {Config.EMBEDDING_DIMENSION}")
+                self._generation = header.get('generation', 0)
+                
+                # Map the preallocated matrix; only the first n_rows rows are in use
+                embeddings = np.load(self.embeddings_file, mmap_mode='r+')
+                if embeddings.shape[1] != header['dim']:
+                    raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match header {header['dim']}")
+                self._embeddings = embeddings
+                self._alive = np.ones(len(embeddings), dtype=bool)
+                self._row_ids = np.full(len(embeddings), -1, dtype=np.int64)
+                self._count = header['n_rows']
+                logger.info(f"Loaded {self._count} existing embeddings")
+                
+                # Move metadata from the JSONL log used before SQLite
+                if os.path.exists(self.legacy_metadata_log_file):
+                    metadata, _ = self._read_metadata_log()
+                    self._import_metadata(metadata[:self._count])
+                    os.remove(self.legacy_metadata_log_file)
                 
+                # A compaction committed by the header may have stopped before
+                # renumbering the metadata; finish it from the tombstones
+                metadata_generation = self._metadata_generation()
+                if metadata_generation > self._generation:
+                    raise ValueError(f"Metadata generation {metadata_generation} is ahead of embeddings generation {self._generation}")
+                if metadata_generation < self._generation:
+                    logger.warning("Completing an interrupted compaction")
+                    self._renumber_metadata()
+                
+                # Records beyond the header's row count belong to an insert
+                # that was interrupted before it was committed
+                with self._db_lock, self._metadata_db as db:
+                    db.execute("DELETE FROM chunks WHERE row >= ?", (self._count,))
+            elif os.path.exists(self.legacy_metadata_file) or os.path.exists(self.legacy_embeddings_file):
+                self._load_legacy_data()
+            else:
+                # Records of a first insert that was never committed
+                with self._db_lock, self._metadata_db as db:
+                    db.execute("DELETE FROM chunks")
+                    db.execute("UPDATE generation SET value = 0")
+            
+            self._load_row_state()
+            
         except Exception as e:
+            # Leave the files alone so the store can be recovered
             logger.error(f"Error loading existing data: {str(e)}")
-            self.embeddings = []
-            self.metadata = []
+            raise
+        
+        self._load_index()
+    
+    def _load_index(self):
+        """Load the saved ANN index, dropping it if it does not fit the store"""
+        if not os.path.exists(self.index_file):
+            return
+        
+        try:
+            index = faiss.read_index(self.index_file)
+            if index.d != Config.EMBEDDING_DIMENSION or index.ntotal > self._count:
+                raise ValueError(f"Index of {index.ntotal} vectors with dimension {index.d} does not match the store")
+            
+            # The index is saved when built; catch it up with rows added since
+            if index.ntotal < self._count:
+                index.add(np.ascontiguousarray(self.embeddings[index.ntotal:]))
+            self._index = index
+            logger.info(f"Loaded HNSW index with {index.ntotal} vectors")
+            
+        except Exception as e:
+            # The index is derived from the embeddings and is rebuilt on the next search
+            logger.warning(f"Dropping unusable HNSW index: {str(e)}")
+            os.remove(self.index_file)
+    
+    def _open_metadata_db(self) -> sqlite3.Connection:
+        """Open the chunk metadata database, creating its table if needed"""
+        os.makedirs(self.vector_store_path, exist_ok=True)
+        # Searches read from pool threads; all access is serialized by _db_lock
+        db = sqlite3.connect(self.metadata_file, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        
+        # Metadata records are keyed by a stable ID; row is the embedding row
+        # they currently occupy and data the orjson-encoded entry
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                row INTEGER NOT NULL,
+                document_id TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                data BLOB NOT NULL
+            )
+        """)
+        db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chunks_document_id
+            ON chunks(document_id)
+        """)
+        
+        # Compaction generation whose row numbers the records hold
+        db.execute("CREATE TABLE IF NOT EXISTS generation (value INTEGER NOT NULL)")
+        if db.execute("SELECT COUNT(*) FROM generation").fetchone()[0] == 0:
+            db.execute("INSERT INTO generation (value) VALUES (0)")
+        db.commit()
+        return db
+    
+    def _metadata_generation(self) -> int:
+        """Get the compaction generation recorded in the metadata database"""
+        with self._db_lock:
+            return self._metadata_db.execute("SELECT value FROM generation").fetchone()[0]
+    
+    def _renumber_metadata(self):
+        """Drop deleted records and renumber the rest to the current generation's rows"""
+        with self._db_lock, self._metadata_db as db:
+            db.execute("DELETE FROM chunks WHERE deleted = 1")
+            # Live records keep their order, so each row is its rank
+            ids = db.execute("SELECT id FROM chunks ORDER BY row").fetchall()
+            db.executemany(
+                "UPDATE chunks SET row = ? WHERE id = ?",
+                ((row, chunk_id) for row, (chunk_id,) in enumerate(ids))
+            )
+            db.execute("UPDATE generation SET value = ?", (self._generation,))
+    
+    def _load_row_state(self):
+        """Restore row IDs, tombstones and the document map from the metadata database"""
+        self._row_ids[:self._count] = -1
+        self._doc_to_indices = defaultdict(list)
+        
+        # Only the small columns are read; entries are decoded lazily on search
+        with self._db_lock:
+            cursor = self._metadata_db.execute(
+                "SELECT id, row, document_id, deleted FROM chunks ORDER BY row"
+            )
+            for chunk_id, row, document_id, deleted in cursor:
+                self._row_ids[row] = chunk_id
+                if deleted:
+                    self._alive[row] = False
+                else:
+                    self._doc_to_indices[document_id].append(row)
+            
+            self._next_id = self._metadata_db.execute(
+                "SELECT COALESCE(MAX(id), -1) + 1 FROM chunks"
+            ).fetchone()[0]
+        
+        self._deleted = self._count - int(np.count_nonzero(self.alive))
+        logger.info(f"Loaded metadata for {len(self._doc_to_indices)} documents")
+    
+    def _import_metadata(self, metadata: List[Dict]):
+        """Replace the metadata database with entries from an older store, one per row"""
+        records = [
+            (
+                i,
+                i,
+                entry['document_id'],
+                int(bool(entry.get('deleted'))),
+                orjson.dumps({key: value for key, value in entry.items() if key not in ('embedding_index', 'deleted')})
+            )
+            for i, entry in enumerate(metadata)
+        ]
+        
+        with self._db_lock, self._metadata_db as db:
+            db.execute("DELETE FROM chunks")
+            db.executemany("""
+                INSERT INTO chunks (id, row, document_id, deleted, data)
+                VALUES (?, ?, ?, ?, ?)
+            """, records)
+            db.execute("UPDATE generation SET value = ?", (self._generation,))
+        logger.info(f"Imported {len(records)} metadata entries")
+    
+    def _read_metadata_log(self) -> Tuple[List[Dict], bool]:
+        """Replay the metadata log into chunk entries, reporting whether it was intact"""
+        metadata = []
+        
+        with open(self.legacy_metadata_log_file, 'rb') as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # A torn final line from an interrupted append
+                    logger.warning("Ignoring truncated metadata log entry")
+                    return metadata, False
+                
+                if 'deleted_indices' in record:
+                    for i in record['deleted_indices']:
+                        metadata[i]['deleted'] = True
+                else:
+                    metadata.append(record)
+        
+        return metadata, True
+    
+    def _load_legacy_data(self):
+        """Load a store saved before append-only persistence and convert it"""
+        embeddings = None
+        if os.path.exists(self.embeddings_file):
+            embeddings = np.load(self.embeddings_file)
+        elif os.path.exists(self.legacy_embeddings_file):
+            with open(self.legacy_embeddings_file, 'rb') as f:
+                # Older stores pickled a list of per-chunk arrays
+                embeddings = np.asarray(pickle.load(f), dtype=np.float32)
+        
+        if embeddings is not None and len(embeddings):
+            # Stores saved before embeddings were normalized at insert are
+            # normalized once here, so cosine similarity is a plain dot product
+            norms = np.linalg.norm(embeddings, axis=1)
+            # Zero vectors score 0 rather than dividing by zero
+            norms[norms == 0] = 1.0
+            self._embeddings = embeddings / norms[:, None]
+            self._alive = np.ones(len(embeddings), dtype=bool)
+            self._row_ids = np.full(len(embeddings), -1, dtype=np.int64)
+            self._count = len(embeddings)
+            logger.info(f"Loaded {self._count} existing embeddings")
+        
+        metadata = []
+        if os.path.exists(self.legacy_metadata_file):
+            with open(self.legacy_metadata_file, 'rb') as f:
+                metadata = orjson.loads(f.read())
+            logger.info(f"Loaded {len(metadata)} existing metadata entries")
+        
+        if self._count or metadata:
+            logger.info("Converting vector store to append-only format")
+            # Metadata goes first; writing the header commits the conversion
+            self._import_metadata(metadata[:self._count])
+            self._save_data()
     
     def _save_data(self):
-        """Save embeddings and metadata to disk"""
+        """Rewrite the embeddings, ANN index and header to disk"""
         try:
             os.makedirs(self.vector_store_path, exist_ok=True)
             
             # Save embeddings
-            with open(self.embeddings_file, 'wb') as f:
-                pickle.dump(self.embeddings, f)
+            self._embeddings = self._write_embeddings(self.embeddings, self._count, self.embeddings_file)
+            self._resize_row_state()
+            
+            # Save the ANN index if one has been built
+            if self._index is not None:
+                self._save_index()
+            elif os.path.exists(self.index_file):
+                os.remove(self.index_file)
             
-            # Save metadata
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.metadata, f, indent=2)
+            self._save_header(self._count, self._generation)
                 
-            logger.info(f"Saved {len(self.embeddings)} embeddings and {len(self.metadata)} metadata entries")
+            logger.info(f"Saved {len(self.embeddings)} embeddings")
             
         except Exception as e:
             logger.error(f"Error saving data: {str(e)}")
             raise
     
+    def _save_header(self, count: int, generation: int):
+        """Record how many embedding rows are in use, committing appended data"""
+        temp_file = self.header_file + ".tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(orjson.dumps({
+                'n_rows': count,
+                'dim': Config.EMBEDDING_DIMENSION,
+                'generation': generation
+            }))
+        os.replace(temp_file, self.header_file)
+    
+    def _save_index(self):
+        """Save the ANN index to disk"""
+        temp_file = self.index_file + ".tmp"
+        faiss.write_index(self._index, temp_file)
+        os.replace(temp_file, self.index_file)
+    
     async def add_documents(self, document_id: str, chunks: List[Dict]):
         """Add document chunks to the vector store"""
         try:
-            logger.info(f"Adding {len(chunks)} chunks for document {document_id}")
-            
-            # Extract text content for embedding
-            texts = [chunk['content'] for chunk in chunks]
-            
-            # Generate embeddings
-            chunk_embeddings = self.model.encode(texts, show_progress_bar=True)
+            # Text without any sentences yields no chunks and nothing to store
+            if not chunks:
+                logger.warning(f"No chunks to add for document {document_id}")
+                return
             
-            # Add to storage
-            for i, (chunk, embedding) in enumerate(zip(chunks, chunk_embeddings)):
-                self.embeddings.append(embedding)
-                
-                # Create metadata entry
-                metadata_entry = {
-                    'chunk_id': chunk['id'],
-                    'document_id': document_id,
-                    'filename': chunk['filename'],
-                    'chunk_index': chunk['chunk_index'],
-                    'content': chunk['content'],
-                    'length': chunk['length'],
-                    'created_at': chunk['created_at'],
-                    'embedding_index': len(self.embeddings) - 1
-                }
-                
-                self.metadata.append(metadata_entry)
+            logger.info(f"Adding {len(chunks)} chunks for document {document_id}")
             
-            # Save to disk
-            self._save_data()
+            # Encoding and the locked write both block, so they run on the write pool
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._write_pool, self._add_documents, document_id, chunks)
             
             logger.info(f"Successfully added {len(chunks)} chunks to vector store")
             
@@ -98,101 +527,397 @@ class VectorStore:
             logger.error(f"Error adding documents to vector store: {str(e)}")
             raise
     
+    def _add_documents(self, document_id: str, chunks: List[Dict]):
+        """Embed chunks and append them to the store"""
+        # Extract text content for embedding
+        texts = [chunk['content'] for chunk in chunks]
+        
+        # Generate unit-length float32 embeddings
+        chunk_embeddings = self._encode(texts, batch_size=64)
+        
+        with self._write_lock:
+            # Add to storage
+            os.makedirs(self.vector_store_path, exist_ok=True)
+            base_index = self._count
+            ids = np.arange(self._next_id, self._next_id + len(chunks))
+            
+            # Create metadata records in one pass
+            records = [
+                (
+                    record_id,
+                    row,
+                    document_id,
+                    orjson.dumps({
+                        'chunk_id': chunk['id'],
+                        'document_id': document_id,
+                        'filename': chunk['filename'],
+                        'chunk_index': chunk['chunk_index'],
+                        'content': chunk['content'],
+                        'length': chunk['length'],
+                        'created_at': chunk['created_at']
+                    })
+                )
+                for record_id, row, chunk in zip(ids.tolist(), range(base_index, base_index + len(chunks)), chunks)
+            ]
+            
+            try:
+                # Metadata is committed before the row count grows, so any
+                # snapshot covering the new rows can resolve them
+                with self._db_lock, self._metadata_db as db:
+                    db.executemany("""
+                        INSERT INTO chunks (id, row, document_id, data)
+                        VALUES (?, ?, ?, ?)
+                    """, records)
+                self._next_id += len(chunks)
+                
+                self._append_embeddings(chunk_embeddings, ids)
+                self._doc_to_indices[document_id].extend(range(base_index, self._count))
+                
+                # Keep an existing ANN index in step with the buffer
+                if self._index is not None:
+                    with self._index_lock.exclusive():
+                        self._index.add(chunk_embeddings)
+                
+                # Commit the new rows by updating the header
+                self._save_header(self._count, self._generation)
+            except Exception:
+                self._rollback_insert(document_id, base_index, int(ids[0]))
+                raise
+    
+    def _rollback_insert(self, document_id: str, base_index: int, first_id: int):
+        """Undo an insert that failed before its header commit"""
+        # Otherwise the next insert would reuse these rows for its own records
+        with self._db_lock, self._metadata_db as db:
+            db.execute("DELETE FROM chunks WHERE id >= ?", (first_id,))
+        self._next_id = first_id
+        self._count = base_index
+        
+        indices = [i for i in self._doc_to_indices.pop(document_id, []) if i < base_index]
+        if indices:
+            self._doc_to_indices[document_id] = indices
+        
+        # HNSW cannot remove vectors, so an index that took the rows is rebuilt
+        # on the next search
+        if self._index is not None and self._index.ntotal > base_index:
+            self._index = None
+    
     async def search(self, query: str, top_k: int = 5) -> List[Dict]:
         """Search for similar chunks"""
         try:
-            if not self.embeddings:
-                logger.warning("No embeddings available for search")
-                return []
-            
-            # Generate query embedding
-            query_embedding = self.model.encode([query])[0]
-            
-            # Calculate similarities
-            similarities = []
-            for i, doc_embedding in enumerate(self.embeddings):
-                similarity = self._cosine_similarity(query_embedding, doc_embedding)
-                similarities.append((i, similarity))
-            
-            # Sort by similarity and get top k
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            top_results = similarities[:top_k]
-            
-            # Filter by similarity threshold
-            threshold = Config.SIMILARITY_THRESHOLD
-            filtered_results = [(i, score) for i, score in top_results if score >= threshold]
-            
-            # Prepare response
-            results = []
-            for idx, score in filtered_results:
-                if idx < len(self.metadata):
-                    result = self.metadata[idx].copy()
-                    result['score'] = float(score)
-                    results.append(result)
-            
-            logger.info(f"Found {len(results)} relevant chunks for query")
-            return results
+            # Scoring runs on the search pool; BLAS releases the GIL, so
+            # concurrent queries proceed in parallel
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._search_pool, self._search, query, top_k)
+            
+        except Exception as e:
+            logger.error(f"Error searching vector store: {str(e)}")
+            return []
+    
+    async def search_batch(self, queries: List[str], top_k: int = 5) -> List[List[Dict]]:
+        """Search for similar chunks for several queries with one encoder pass"""
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._search_pool, self._search_batch, queries, top_k)
             
         except Exception as e:
             logger.error(f"Error searching vector store: {str(e)}")
+            return [[] for _ in queries]
+    
+    def _search(self, query: str, top_k: int) -> List[Dict]:
+        """Search for chunks similar to one query"""
+        snapshot = self._snapshot()
+        if snapshot.live_count == 0:
+            logger.warning("No embeddings available for search")
+            return []
+        
+        # Generate the query embedding, reusing it for repeated queries
+        query_embedding = self._encode_query(query)
+        
+        top_indices, top_scores = self._rank(snapshot, query_embedding[None, :], top_k)[0]
+        results = self._collect_results(snapshot, top_indices, top_scores)
+        
+        logger.info(f"Found {len(results)} relevant chunks for query")
+        return results
+    
+    def _search_batch(self, queries: List[str], top_k: int) -> List[List[Dict]]:
+        """Search for chunks similar to each of several queries"""
+        if not queries:
             return []
+        
+        snapshot = self._snapshot()
+        if snapshot.live_count == 0:
+            logger.warning("No embeddings available for search")
+            return [[] for _ in queries]
+        
+        # Encode all queries in a single batched forward pass
+        query_embeddings = self._encode(queries, batch_size=32)
+        
+        results = [
+            self._collect_results(snapshot, top_indices, top_scores)
+            for top_indices, top_scores in self._rank(snapshot, query_embeddings, top_k)
+        ]
+        
+        logger.info(f"Found relevant chunks for {len(queries)} queries")
+        return results
+    
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Encode texts as unit-length float32 vectors"""
+        with _ENCODER_LOCK:
+            embeddings = self.model.encode(
+                texts,
+                batch_size=batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+        return embeddings.astype(np.float32, copy=False)
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Encode a query as a unit-length float32 vector"""
+        embedding = self._encode([query], batch_size=1)[0]
+        
+        # Cached vectors are shared between searches, so keep them immutable
+        embedding.flags.writeable = False
+        return embedding
+    
+    def _snapshot(self) -> _Snapshot:
+        """Capture the current rows, tombstones, row IDs and index for a search"""
+        self._build_index()
+        
+        with self._write_lock:
+            return _Snapshot(
+                embeddings=self.embeddings,
+                alive=self.alive,
+                row_ids=self.row_ids,
+                live_count=self.live_count,
+                index=self._index
+            )
+    
+    def _rank(self, snapshot: _Snapshot, query_embeddings: np.ndarray, top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Get the top k chunk indices and scores for each query embedding"""
+        top_k = snapshot.live_count if top_k is None else min(top_k, snapshot.live_count)
+        if top_k <= 0:
+            empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+            return [empty] * len(query_embeddings)
+        
+        # Large stores are searched through the ANN index, small ones exactly
+        if snapshot.index is not None:
+            return [self._search_index(snapshot, query_embedding, top_k) for query_embedding in query_embeddings]
+        return self._search_exact(snapshot, query_embeddings, top_k)
+    
+    def _collect_results(self, snapshot: _Snapshot, top_indices: np.ndarray, top_scores: np.ndarray) -> List[Dict]:
+        """Build result entries for ranked chunks that pass the similarity threshold"""
+        # Filter by similarity threshold with one vectorized comparison
+        passing = top_scores >= Config.SIMILARITY_THRESHOLD
+        
+        indices = top_indices[passing]
+        scores = top_scores[passing]
+        
+        # Prepare response, fetching metadata for the hits only; rows whose
+        # record is gone (deleted and compacted since the snapshot) are skipped
+        entries = self._fetch_metadata(snapshot.row_ids[indices].tolist())
+        return [
+            {**entry, 'embedding_index': idx, 'score': score}
+            for idx, score, entry in zip(indices.tolist(), scores.tolist(), entries)
+            if entry is not None
+        ]
+    
+    def _fetch_metadata(self, ids: List[int]) -> List[Optional[Dict]]:
+        """Fetch and decode metadata entries by record ID, in the order given"""
+        data = {}
+        # Look up in batches that stay under SQLite's bound parameter limit
+        for start in range(0, len(ids), _METADATA_BATCH):
+            batch = ids[start:start + _METADATA_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            with self._db_lock:
+                rows = self._metadata_db.execute(
+                    f"SELECT id, data FROM chunks WHERE id IN ({placeholders})", batch
+                ).fetchall()
+            data.update(rows)
+        
+        return [orjson.loads(data[i]) if i in data else None for i in ids]
+    
+    def _search_exact(self, snapshot: _Snapshot, query_embeddings: np.ndarray, top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Score every chunk against each query and return the top k per query"""
+        # Cosine similarities of all chunks and queries in one product, shape (N, B)
+        scores = snapshot.embeddings @ query_embeddings.T
+        
+        # Deleted rows can never be selected
+        if snapshot.live_count < len(snapshot.embeddings):
+            scores[~snapshot.alive] = -np.inf
+        
+        # Select the top k per query without sorting every score
+        top_indices = np.argpartition(-scores, top_k - 1, axis=0)[:top_k]
+        
+        ranked = []
+        for column in range(scores.shape[1]):
+            candidates = top_indices[:, column]
+            candidate_scores = scores[candidates, column]
+            order = np.argsort(-candidate_scores)
+            ranked.append((candidates[order], candidate_scores[order]))
+        return ranked
+    
+    def _search_index(self, snapshot: _Snapshot, query_embedding: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the top k indices and scores, reranking ANN candidates exactly"""
+        count = len(snapshot.embeddings)
+        # The index still holds deleted rows, so fetch proportionally more
+        candidates = min(top_k * _RERANK_FACTOR * count // snapshot.live_count, count)
+        # Search breadth is passed per call, so concurrent searches share the index
+        params = faiss.SearchParametersHNSW(efSearch=max(_HNSW_EF_SEARCH, candidates))
+        with self._index_lock.shared():
+            _, indices = snapshot.index.search(query_embedding[None, :], candidates, params=params)
+        
+        # FAISS pads missing neighbours with -1; rows added after the snapshot
+        # and deleted rows are dropped too
+        indices = indices[0][(indices[0] >= 0) & (indices[0] < count)]
+        indices = indices[snapshot.alive[indices]]
+        
+        # Quantized scores are approximate, so rescore candidates in float32
+        scores = snapshot.embeddings[indices] @ query_embedding
+        order = np.argsort(-scores)[:top_k]
+        return indices[order], scores[order]
     
-    def _cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
-        """Calculate cosine similarity between two vectors"""
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
+    def _build_index(self):
+        """Build the SQ8 HNSW index once the store passes the size threshold"""
+        if self._index is not None or self._count < Config.ANN_INDEX_THRESHOLD:
+            return
         
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
+        # One search builds the index; others meanwhile search exactly
+        if not self._build_lock.acquire(blocking=False):
+            return
         
-        return dot_product / (norm1 * norm2)
+        try:
+            with self._write_lock:
+                if self._index is not None or self._count < Config.ANN_INDEX_THRESHOLD:
+                    return
+                # Rows below the count are never modified, so the build reads
+                # them without holding the lock
+                matrix = np.ascontiguousarray(self.embeddings)
+                generation = self._generation
+            
+            logger.info(f"Building HNSW index over {len(matrix)} embeddings")
+            # Inner product over unit vectors is cosine similarity; vectors are
+            # stored as 8-bit codes, trained on the whole (threshold-sized) matrix
+            index = faiss.IndexHNSWSQ(
+                matrix.shape[1],
+                faiss.ScalarQuantizer.QT_8bit,
+                _HNSW_M,
+                faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(matrix)
+            index.add(matrix)
+            
+            # Persist it so restarts only add the rows inserted since
+            temp_file = self.index_file + ".tmp"
+            faiss.write_index(index, temp_file)
+            
+            with self._write_lock:
+                # Compaction renumbered the rows during the build
+                if self._generation != generation:
+                    os.remove(temp_file)
+                    return
+                
+                # Catch up with rows appended during the build
+                if len(matrix) < self._count:
+                    index.add(np.ascontiguousarray(self.embeddings[len(matrix):]))
+                os.replace(temp_file, self.index_file)
+                self._index = index
+        finally:
+            self._build_lock.release()
     
     async def delete_document(self, document_id: str):
         """Delete all chunks for a document"""
         try:
-            # Find indices to remove
-            indices_to_remove = []
-            for i, metadata in enumerate(self.metadata):
-                if metadata['document_id'] == document_id:
-                    indices_to_remove.append(i)
+            # Deleting may compact the store, so it runs on the write pool
+            loop = asyncio.get_running_loop()
+            deleted = await loop.run_in_executor(self._write_pool, self._delete_document, document_id)
             
-            if not indices_to_remove:
+            if not deleted:
                 logger.warning(f"No chunks found for document {document_id}")
                 return
             
-            # Remove in reverse order to maintain indices
-            indices_to_remove.sort(reverse=True)
+            logger.info(f"Deleted {deleted} chunks for document {document_id}")
             
-            for idx in indices_to_remove:
-                del self.embeddings[idx]
-                del self.metadata[idx]
+        except Exception as e:
+            logger.error(f"Error deleting document: {str(e)}")
+            raise
+    
+    def _delete_document(self, document_id: str) -> int:
+        """Tombstone a document's chunks and return how many were deleted"""
+        with self._write_lock:
+            # Find indices to remove
+            indices_to_remove = self._doc_to_indices.pop(document_id, [])
             
-            # Update embedding indices in metadata
-            for i, metadata in enumerate(self.metadata):
-                metadata['embedding_index'] = i
+            if not indices_to_remove:
+                return 0
             
-            # Save updated data
-            self._save_data()
+            with self._db_lock, self._metadata_db as db:
+                db.execute("UPDATE chunks SET deleted = 1 WHERE document_id = ?", (document_id,))
             
-            logger.info(f"Deleted {len(indices_to_remove)} chunks for document {document_id}")
+            # Tombstone the rows; embeddings and the ANN index stay valid
+            # since search masks dead rows. The mask is replaced rather than
+            # modified so searches in flight keep a consistent view
+            alive = self._alive.copy()
+            alive[indices_to_remove] = False
+            self._alive = alive
+            self._deleted += len(indices_to_remove)
             
-        except Exception as e:
-            logger.error(f"Error deleting document: {str(e)}")
-            raise
+            if self.live_count < _COMPACT_LIVE_RATIO * self._count:
+                self._compact()
+        
+        return len(indices_to_remove)
+    
+    def _compact(self):
+        """Drop deleted rows from the store and renumber the rest"""
+        logger.info(f"Compacting vector store: dropping {self._deleted} deleted chunks")
+        
+        # Rows without a metadata record can never be returned, so they go
+        # too; the kept rows are then exactly the live records in row order
+        keep = self.alive & (self.row_ids >= 0)
+        row_ids = self.row_ids[keep]
+        count = len(row_ids)
+        # New position of each row that is kept
+        new_rows = np.cumsum(keep) - 1
+        generation = self._generation + 1
+        previous_file = self.embeddings_file
+        
+        # Write the live rows to the next generation's file; the store keeps
+        # its current state until the header commits the switch
+        embeddings = self._write_embeddings(self.embeddings[keep], count, self._embeddings_path(generation))
+        # HNSW cannot remove vectors, so the index is rebuilt on the next search
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)
+        self._save_header(count, generation)
+        
+        self._embeddings = embeddings
+        self._count = count
+        self._resize_row_state()
+        self._alive[:count] = True
+        self._row_ids[:count] = row_ids
+        self._deleted = 0
+        self._generation = generation
+        self._index = None
+        
+        # Update embedding indices in the document map
+        self._doc_to_indices = defaultdict(list, {
+            document_id: new_rows[indices].tolist()
+            for document_id, indices in self._doc_to_indices.items()
+        })
+        
+        logger.info(f"Saved {count} embeddings")
+        
+        # Records keep their IDs, so snapshots taken before compaction can
+        # still resolve them; a crash before this point is finished on load
+        self._renumber_metadata()
+        os.remove(previous_file)
     
     async def get_stats(self) -> Dict:
         """Get vector store statistics"""
         try:
-            unique_documents = set()
-            total_chunks = len(self.metadata)
-            
-            for metadata in self.metadata:
-                unique_documents.add(metadata['document_id'])
-            
+            # The document map holds exactly the documents with live chunks
             return {
-                'total_documents': len(unique_documents),
-                'total_chunks': total_chunks,
+                'total_documents': len(self._doc_to_indices),
+                'total_chunks': self.live_count,
                 'embedding_dimension': Config.EMBEDDING_DIMENSION,
                 'model_name': Config.EMBEDDING_MODEL
             }
@@ -208,7 +933,11 @@ class VectorStore:
     
     def get_document_chunks(self, document_id: str) -> List[Dict]:
         """Get all chunks for a specific document"""
-        return [
-            metadata for metadata in self.metadata
-            if metadata['document_id'] == document_id
-        ]
+        with self._db_lock:
+            rows = self._metadata_db.execute("""
+                SELECT row, data FROM chunks
+                WHERE document_id = ? AND deleted = 0
+                ORDER BY row
+            """, (document_id,)).fetchall()
+        
+        return [{**orjson.loads(data), 'embedding_index': row} for row, data in rows]
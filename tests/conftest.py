@@ -0,0 +1,46 @@
+import pytest
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+# Config validates the API key on import, so provide one for the test run
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+# Add the parent directory to sys.path to import the app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from app import app, get_document_processor, get_vector_store, get_llm_service, get_db_service
+from services.document_processor import DocumentProcessor
+from services.vector_store import VectorStore
+from services.llm_service import LLMService
+from services.database import DatabaseService
+
+@pytest.fixture(scope="module")
+def client():
+    """Create one test client per module; services come from the overrides below"""
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+@pytest.fixture
+def services():
+    """Install fresh mocked services for a test through dependency overrides"""
+    # Specced mocks turn the services' async methods into AsyncMocks
+    services = SimpleNamespace(
+        document_processor=Mock(spec=DocumentProcessor),
+        vector_store=Mock(spec=VectorStore),
+        llm_service=Mock(spec=LLMService),
+        db_service=Mock(spec=DatabaseService)
+    )
+    # No document has been uploaded before unless a test says otherwise
+    services.db_service.get_document_by_hash.return_value = None
+    
+    app.dependency_overrides.update({
+        get_document_processor: lambda: services.document_processor,
+        get_vector_store: lambda: services.vector_store,
+        get_llm_service: lambda: services.llm_service,
+        get_db_service: lambda: services.db_service
+    })
+    return services
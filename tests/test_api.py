@@ -1,7 +1,8 @@
 import pytest
 import asyncio
-from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch
+import json
+import sqlite3
+from unittest.mock import patch
 import tempfile
 import os
 import sys
@@ -9,11 +10,8 @@ import sys
 # Add the parent directory to sys.path to import the app
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app
 from config import Config
 
-client = TestClient(app)
-
 @pytest.fixture
 def sample_pdf_content():
     """Create a simple PDF content for testing"""
@@ -26,32 +24,86 @@ def sample_text_content():
     return "This is a sample document for testing. It contains multiple sentences for chunking."
 
 class TestHealthEndpoints:
-    def test_root_endpoint(self):
+    def test_root_endpoint(self, client):
         response = client.get("/")
         assert response.status_code == 200
         assert "RAG Pipeline API is running!" in response.json()["message"]
     
-    def test_health_endpoint(self):
+    def test_health_endpoint(self, client):
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json()["status"] == "healthy"
 
 class TestDocumentUpload:
-    def test_upload_text_file(self, sample_text_content):
+    def test_upload_text_file(self, client, services, sample_text_content):
         """Test uploading a text file"""
         files = {"file": ("test.txt", sample_text_content, "text/plain")}
         
-        with patch('services.document_processor.DocumentProcessor.process_document') as mock_process:
-            mock_process.return_value = ("test-id", [{"id": "chunk1", "content": "test"}])
-            
-            with patch('services.vector_store.VectorStore.add_documents') as mock_vector:
-                with patch('services.database.DatabaseService.store_document_metadata') as mock_db:
-                    response = client.post("/upload", files=files)
-                    
-                    assert response.status_code == 200
-                    assert "Document uploaded and processed successfully" in response.json()["message"]
+        services.document_processor.process_document.return_value = (
+            "test-id", [{"id": "chunk1", "content": "test"}], 1
+        )
+        
+        response = client.post("/upload", files=files)
+        
+        assert response.status_code == 200
+        assert "Document uploaded and processed successfully" in response.json()["message"]
+        services.vector_store.add_documents.assert_awaited_once()
+        services.db_service.store_document_metadata.assert_awaited_once()
+        services.db_service.store_chunks_metadata.assert_awaited_once()
+    
+    def test_upload_reads_file_in_place(self, client, services, sample_text_content):
+        """Test that the processor reads the whole upload from the start"""
+        files = {"file": ("test.txt", sample_text_content, "text/plain")}
+        received = []
+        
+        async def process_document(source, filename):
+            received.append(source.read())
+            return "test-id", [{"id": "chunk1", "content": "test"}], 1
+        services.document_processor.process_document.side_effect = process_document
+        
+        response = client.post("/upload", files=files)
+        
+        assert response.status_code == 200
+        assert received == [sample_text_content.encode()]
+    
+    def test_upload_duplicate_file(self, client, services, sample_text_content):
+        """Test that re-uploading identical content reuses the existing document"""
+        files = {"file": ("test.txt", sample_text_content, "text/plain")}
+        
+        services.db_service.get_document_by_hash.return_value = {
+            "document_id": "existing-id", "filename": "test.txt", "chunks": 3
+        }
+        
+        response = client.post("/upload", files=files)
+        
+        assert response.status_code == 200
+        assert response.json()["document_id"] == "existing-id"
+        services.document_processor.process_document.assert_not_called()
     
-    def test_upload_unsupported_file(self):
+    def test_upload_concurrent_duplicate(self, client, services, sample_text_content):
+        """Test that losing a race to store identical content discards the new chunks"""
+        files = {"file": ("test.txt", sample_text_content, "text/plain")}
+        
+        services.document_processor.process_document.return_value = (
+            "test-id", [{"id": "chunk1", "content": "test"}], 1
+        )
+        # The hash is free when checked, then taken by the time metadata is stored
+        services.db_service.get_document_by_hash.side_effect = [
+            None,
+            {"document_id": "existing-id", "filename": "test.txt", "chunks": 3}
+        ]
+        services.db_service.store_document_metadata.side_effect = sqlite3.IntegrityError(
+            "UNIQUE constraint failed: documents.content_hash"
+        )
+        
+        response = client.post("/upload", files=files)
+        
+        assert response.status_code == 200
+        assert response.json()["document_id"] == "existing-id"
+        services.vector_store.delete_document.assert_awaited_once_with("test-id")
+        services.db_service.store_chunks_metadata.assert_not_called()
+    
+    def test_upload_unsupported_file(self, client, services):
         """Test uploading an unsupported file type"""
         files = {"file": ("test.exe", b"binary content", "application/octet-stream")}
         
@@ -59,13 +111,24 @@ class TestDocumentUpload:
         assert response.status_code == 400
         assert "Unsupported file type" in response.json()["detail"]
     
-    def test_upload_no_file(self):
+    def test_upload_too_large_file(self, client, services, sample_text_content):
+        """Test that uploads over the size limit are rejected before processing"""
+        files = {"file": ("test.txt", sample_text_content, "text/plain")}
+        
+        with patch.object(Config, 'MAX_FILE_SIZE_MB', 0):
+            response = client.post("/upload", files=files)
+        
+        assert response.status_code == 413
+        assert "File too large" in response.json()["detail"]
+        services.document_processor.process_document.assert_not_called()
+    
+    def test_upload_no_file(self, client, services):
         """Test uploading without a file"""
         response = client.post("/upload")
         assert response.status_code == 422  # Validation error
 
 class TestQuerying:
-    def test_query_with_results(self):
+    def test_query_with_results(self, client, services):
         """Test querying with mock results"""
         query_data = {"query": "What is the main topic?", "top_k": 3}
         
@@ -79,40 +142,81 @@ class TestQuerying:
             }
         ]
         
-        with patch('services.vector_store.VectorStore.search') as mock_search:
-            mock_search.return_value = mock_chunks
-            
-            with patch('services.llm_service.LLMService.generate_response') as mock_llm:
-                mock_llm.return_value = "This document is about machine learning."
-                
-                response = client.post("/query", json=query_data)
-                
-                assert response.status_code == 200
-                result = response.json()
-                assert "answer" in result
-                assert "sources" in result
-                assert len(result["sources"]) > 0
+        services.vector_store.search.return_value = mock_chunks
+        services.llm_service.generate_response.return_value = "This document is about machine learning."
+        
+        response = client.post("/query", json=query_data)
+        
+        assert response.status_code == 200
+        result = response.json()
+        assert "answer" in result
+        assert "sources" in result
+        assert len(result["sources"]) > 0
     
-    def test_query_no_results(self):
+    def test_query_no_results(self, client, services):
         """Test querying with no results"""
         query_data = {"query": "What is the main topic?"}
         
-        with patch('services.vector_store.VectorStore.search') as mock_search:
-            mock_search.return_value = []
-            
-            response = client.post("/query", json=query_data)
-            
-            assert response.status_code == 200
-            result = response.json()
-            assert "couldn't find any relevant information" in result["answer"]
+        services.vector_store.search.return_value = []
+        
+        response = client.post("/query", json=query_data)
+        
+        assert response.status_code == 200
+        result = response.json()
+        assert "couldn't find any relevant information" in result["answer"]
+        services.llm_service.generate_response.assert_not_called()
     
-    def test_query_invalid_data(self):
+    def test_query_invalid_data(self, client, services):
         """Test querying with invalid data"""
         response = client.post("/query", json={})
         assert response.status_code == 422  # Validation error
 
+def parse_events(body):
+    """Split a server-sent event stream into (event, data) pairs"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event", "message"), fields["data"]))
+    return events
+
+class TestStreamingQuery:
+    def test_stream_with_results(self, client, services):
+        """Test that sources come first, then JSON-encoded tokens, then done"""
+        services.vector_store.search.return_value = [
+            {"document_id": "doc1", "filename": "test.txt", "content": "About ML", "score": 0.9}
+        ]
+        
+        async def tokens(query, relevant_chunks):
+            for token in ["Machine", " learning\n", "."]:
+                yield token
+        services.llm_service.generate_response_stream.side_effect = tokens
+        
+        response = client.post("/query/stream", json={"query": "What is it about?"})
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_events(response.text)
+        assert events[0][0] == "sources"
+        assert json.loads(events[0][1])[0]["filename"] == "test.txt"
+        # Newlines inside tokens stay escaped, so they cannot break the framing
+        assert [json.loads(data) for event, data in events[1:-1]] == ["Machine", " learning\n", "."]
+        assert events[-1] == ("done", "[DONE]")
+    
+    def test_stream_no_results(self, client, services):
+        """Test that a query without matches streams the fixed answer"""
+        services.vector_store.search.return_value = []
+        
+        response = client.post("/query/stream", json={"query": "What is it about?"})
+        
+        assert response.status_code == 200
+        events = parse_events(response.text)
+        assert events[0] == ("sources", "[]")
+        assert "couldn't find any relevant information" in json.loads(events[1][1])
+        assert events[2] == ("done", "[DONE]")
+        services.llm_service.generate_response_stream.assert_not_called()
+
 class TestDocumentManagement:
-    def test_get_documents(self):
+    def test_get_documents(self, client, services):
         """Test getting all documents"""
         mock_docs = [
             {
@@ -125,55 +229,44 @@ class TestDocumentManagement:
             }
         ]
         
-        with patch('services.database.DatabaseService.get_all_documents') as mock_db:
-            mock_db.return_value = mock_docs
-            
-            response = client.get("/documents")
-            
-            assert response.status_code == 200
-            assert len(response.json()) == 1
-            assert response.json()[0]["filename"] == "test.txt"
+        services.db_service.get_all_documents.return_value = mock_docs
+        
+        response = client.get("/documents")
+        
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        assert response.json()[0]["filename"] == "test.txt"
     
-    def test_delete_document(self):
+    def test_delete_document(self, client, services):
         """Test deleting a document"""
-        with patch('services.vector_store.VectorStore.delete_document') as mock_vector:
-            with patch('services.database.DatabaseService.delete_document') as mock_db:
-                response = client.delete("/documents/test-doc-id")
-                
-                assert response.status_code == 200
-                assert "deleted successfully" in response.json()["message"]
+        response = client.delete("/documents/test-doc-id")
+        
+        assert response.status_code == 200
+        assert "deleted successfully" in response.json()["message"]
+        services.vector_store.delete_document.assert_awaited_once_with("test-doc-id")
+        services.db_service.delete_document.assert_awaited_once_with("test-doc-id")
     
-    def test_get_stats(self):
+    def test_get_stats(self, client, services):
         """Test getting system statistics"""
         mock_stats = {
             "documents": {"total": 5},
             "queries_last_30_days": {"total": 100}
         }
         
-        with patch('services.database.DatabaseService.get_stats') as mock_db:
-            mock_db.return_value = mock_stats
-            
-            response = client.get("/stats")
-            
-            assert response.status_code == 200
-            assert response.json()["documents"]["total"] == 5
+        services.db_service.get_stats.return_value = mock_stats
+        
+        response = client.get("/stats")
+        
+        assert response.status_code == 200
+        assert response.json()["documents"]["total"] == 5
 
 class TestConfiguration:
     def test_config_validation(self):
         """Test configuration validation"""
-        # Test that config validation works
-        original_key = os.environ.get('GROQ_API_KEY', '')
-        
-        # Test with missing API key
-        if 'GROQ_API_KEY' in os.environ:
-            del os.environ['GROQ_API_KEY']
-        
-        with pytest.raises(ValueError):
-            Config.validate_config()
-        
-        # Restore original key
-        if original_key:
-            os.environ['GROQ_API_KEY'] = original_key
+        # The key is read when Config is imported, so blank the loaded value
+        with patch.object(Config, 'GROQ_API_KEY', ''):
+            with pytest.raises(ValueError):
+                Config.validate_config()
 
 # Integration tests
 class TestIntegration:
@@ -185,4 +278,4 @@ class TestIntegration:
         pass
 
 if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
\ No newline at end of file
+    pytest.main([__file__, "-v"])
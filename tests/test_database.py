@@ -0,0 +1,179 @@
+import pytest
+import pytest_asyncio
+import os
+import sys
+import sqlite3
+
+# Add the parent directory to sys.path to import the services
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from services.database import DatabaseService
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the database service at a temporary SQLite file"""
+    path = tmp_path / "documents.db"
+    monkeypatch.setattr(Config, 'DATABASE_URL', f"sqlite:///{path}")
+    return path
+
+@pytest_asyncio.fixture
+async def db_service(db_path):
+    """Create an initialized database service on the temporary file"""
+    service = DatabaseService()
+    await service.initialize()
+    yield service
+    await service.close()
+
+def make_metadata(document_id, content_hash, file_size=1000, pages=2, chunks=5):
+    """Create document metadata shaped like the upload endpoint's"""
+    return {
+        'document_id': document_id,
+        'filename': f"{document_id}.txt",
+        'file_size': file_size,
+        'pages': pages,
+        'chunks': chunks,
+        'content_hash': content_hash
+    }
+
+class TestMigration:
+    @pytest.mark.asyncio
+    async def test_upgrade_baseline_schema(self, db_path):
+        """Test that a database created before deduplication gains the hash column and index"""
+        db = sqlite3.connect(db_path)
+        db.execute("""
+            CREATE TABLE documents (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                pages INTEGER NOT NULL,
+                chunks INTEGER NOT NULL,
+                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        db.execute("""
+            CREATE TABLE queries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query_text TEXT NOT NULL,
+                response_time REAL,
+                chunks_retrieved INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Rows from before the migration have no hash, and several may coexist
+        db.executemany(
+            "INSERT INTO documents (id, filename, file_size, pages, chunks) VALUES (?, ?, ?, ?, ?)",
+            [("old1", "a.txt", 10, 1, 1), ("old2", "b.txt", 20, 1, 2)]
+        )
+        db.commit()
+        db.close()
+
+        service = DatabaseService()
+        await service.initialize()
+        try:
+            documents = await service.get_all_documents()
+            assert {document['document_id'] for document in documents} == {"old1", "old2"}
+
+            await service.store_document_metadata(make_metadata("new", "hash1"))
+            assert (await service.get_document_by_hash("hash1"))['document_id'] == "new"
+        finally:
+            await service.close()
+
+        db = sqlite3.connect(db_path)
+        columns = {row[1] for row in db.execute("PRAGMA table_info(documents)")}
+        indexes = {row[1] for row in db.execute("PRAGMA index_list(documents)")}
+        db.close()
+        assert "content_hash" in columns
+        assert "idx_documents_content_hash" in indexes
+
+    @pytest.mark.asyncio
+    async def test_initialize_twice(self, db_path):
+        """Test that initializing an up-to-date database leaves it unchanged"""
+        for _ in range(2):
+            service = DatabaseService()
+            await service.initialize()
+            await service.close()
+
+class TestDocuments:
+    @pytest.mark.asyncio
+    async def test_duplicate_hash_rejected(self, db_service):
+        """Test that a second document with the same content hash violates the unique index"""
+        await db_service.store_document_metadata(make_metadata("doc1", "hash1"))
+
+        with pytest.raises(sqlite3.IntegrityError):
+            await db_service.store_document_metadata(make_metadata("doc2", "hash1"))
+
+        # The shared connection keeps working after the failed insert
+        await db_service.store_document_metadata(make_metadata("doc3", "hash3"))
+        documents = await db_service.get_all_documents()
+        assert {document['document_id'] for document in documents} == {"doc1", "doc3"}
+
+    @pytest.mark.asyncio
+    async def test_get_document_by_hash(self, db_service):
+        """Test looking up documents by content hash"""
+        await db_service.store_document_metadata(make_metadata("doc1", "hash1"))
+
+        document = await db_service.get_document_by_hash("hash1")
+
+        assert document['document_id'] == "doc1"
+        assert document['filename'] == "doc1.txt"
+        assert document['chunks'] == 5
+        assert await db_service.get_document_by_hash("missing") is None
+
+    @pytest.mark.asyncio
+    async def test_delete_document(self, db_service):
+        """Test that deleting a document removes it and its chunks"""
+        await db_service.store_document_metadata(make_metadata("doc1", "hash1"))
+        await db_service.store_chunks_metadata([
+            {'id': f"doc1_{i}", 'document_id': "doc1", 'chunk_index': i, 'length': 100}
+            for i in range(3)
+        ])
+
+        await db_service.delete_document("doc1")
+
+        assert await db_service.get_document_by_id("doc1") is None
+        assert await db_service.get_document_by_hash("hash1") is None
+        cursor = await db_service._db.execute("SELECT COUNT(*) FROM chunks")
+        assert (await cursor.fetchone())[0] == 0
+
+class TestStats:
+    @pytest.mark.asyncio
+    async def test_stats_keys_and_values(self, db_service):
+        """Test the statistics response, counting only queries from the last 30 days"""
+        await db_service.store_document_metadata(make_metadata("doc1", "hash1", file_size=1000, pages=2, chunks=5))
+        await db_service.store_document_metadata(make_metadata("doc2", "hash2", file_size=3000, pages=4, chunks=7))
+        await db_service.log_query("recent", 1.0, 4)
+        await db_service.log_query("recent again", 3.0, 2)
+        await db_service._db.execute("""
+            INSERT INTO queries (query_text, response_time, chunks_retrieved, created_at)
+            VALUES ('old', 100.0, 50, datetime('now', '-31 days'))
+        """)
+        await db_service._db.commit()
+
+        stats = await db_service.get_stats()
+
+        assert stats['documents'] == {
+            'total': 2,
+            'total_size_bytes': 4000,
+            'total_pages': 6,
+            'total_chunks': 12,
+            'average_file_size_bytes': 2000
+        }
+        assert stats['queries_last_30_days'] == {
+            'total': 2,
+            'average_response_time_seconds': 2.0,
+            'average_chunks_retrieved': 3.0
+        }
+        assert 'generated_at' in stats
+
+    @pytest.mark.asyncio
+    async def test_stats_on_empty_database(self, db_service):
+        """Test that aggregates over empty tables are reported as zero"""
+        stats = await db_service.get_stats()
+
+        assert set(stats['documents']) == {
+            'total', 'total_size_bytes', 'total_pages', 'total_chunks', 'average_file_size_bytes'
+        }
+        assert all(value == 0 for value in stats['documents'].values())
+        assert all(value == 0 for value in stats['queries_last_30_days'].values())
@@ -0,0 +1,106 @@
+import pytest
+import os
+import sys
+import tempfile
+
+# Add the parent directory to sys.path to import the services
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import docx
+import pypdfium2 as pdfium
+
+from services.document_processor import DocumentProcessor
+
+@pytest.fixture
+def processor():
+    """Create a processor with small chunks for testing"""
+    processor = DocumentProcessor()
+    processor.chunk_size = 50
+    processor.chunk_overlap = 20
+    return processor
+
+@pytest.fixture
+def spooled_upload():
+    """Create a spooled upload file that has already spilled to disk"""
+    with tempfile.SpooledTemporaryFile(max_size=1) as upload:
+        yield upload
+
+@pytest.fixture
+def numbered_text():
+    """Create text made of short, distinguishable sentences"""
+    return " ".join(f"S{i:02d}." for i in range(30))
+
+class TestChunking:
+    def test_chunks_respect_chunk_size(self, processor, numbered_text):
+        """Test that chunks of short sentences never exceed the chunk size"""
+        chunks = processor._create_chunks(numbered_text, "doc1", "test.txt")
+
+        assert len(chunks) > 1
+        assert all(chunk["length"] <= processor.chunk_size for chunk in chunks)
+        assert [chunk["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+
+    def test_chunks_overlap(self, processor, numbered_text):
+        """Test that consecutive chunks share the sentences in the overlap window"""
+        chunks = processor._create_chunks(numbered_text, "doc1", "test.txt")
+
+        assert chunks[0]["content"].endswith("S09.")
+        assert chunks[1]["content"].startswith("S06.")
+
+    def test_chunks_cover_all_sentences(self, processor, numbered_text):
+        """Test that no sentence is dropped while chunking"""
+        chunks = processor._create_chunks(numbered_text, "doc1", "test.txt")
+        combined = " ".join(chunk["content"] for chunk in chunks)
+
+        assert all(f"S{i:02d}." in combined for i in range(30))
+
+    def test_long_sentence_kept_whole(self, processor):
+        """Test that a sentence longer than the chunk size becomes its own chunk"""
+        sentence = "This single sentence is deliberately longer than the configured chunk size."
+        chunks = processor._create_chunks(sentence + " Short one.", "doc1", "test.txt")
+
+        assert chunks[0]["content"] == sentence
+        assert chunks[-1]["content"] == "Short one."
+
+    def test_long_sentence_after_short_ones(self, processor, numbered_text):
+        """Test that a long sentence after short ones does not repeat their tail"""
+        sentence = "This single sentence is deliberately longer than the configured chunk size."
+        chunks = processor._create_chunks(numbered_text + " " + sentence, "doc1", "test.txt")
+        contents = [chunk["content"] for chunk in chunks]
+
+        assert contents[-1] == sentence
+        assert contents[-2].endswith("S29.")
+        # No chunk is just a part of the chunk before it
+        assert not any(current in previous for previous, current in zip(contents, contents[1:]))
+
+class TestExtraction:
+    @pytest.mark.asyncio
+    async def test_process_docx_from_disk(self, processor, spooled_upload):
+        """Test that a DOCX upload spilled to disk is parsed from the spooled file"""
+        document = docx.Document()
+        document.add_paragraph("First paragraph of the document.")
+        document.add_paragraph("Second paragraph of the document.")
+        document.save(spooled_upload)
+        spooled_upload.seek(0)
+        assert spooled_upload._rolled
+
+        document_id, chunks, page_count = await processor.process_document(spooled_upload, "test.docx")
+
+        assert page_count == 1
+        assert chunks and all(chunk["document_id"] == document_id for chunk in chunks)
+        combined = " ".join(chunk["content"] for chunk in chunks)
+        assert "First paragraph" in combined and "Second paragraph" in combined
+
+    def test_extract_pdf_from_disk(self, processor, spooled_upload):
+        """Test that a PDF upload spilled to disk is parsed from the spooled file"""
+        pdf = pdfium.PdfDocument.new()
+        pdf.new_page(612, 792)
+        pdf.new_page(612, 792)
+        pdf.save(spooled_upload)
+        pdf.close()
+        spooled_upload.seek(0)
+        assert spooled_upload._rolled
+
+        text, page_count = processor._extract_text(spooled_upload, "test.pdf")
+
+        assert text == ""
+        assert page_count == 2
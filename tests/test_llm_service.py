@@ -0,0 +1,65 @@
+import pytest
+import os
+import sys
+import httpx
+
+# Add the parent directory to sys.path to import the services
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.llm_service import LLMService
+
+def stream_body(*lines):
+    """Join server-sent event lines into a response body"""
+    return "".join(line + "\n" for line in lines).encode()
+
+@pytest.fixture
+def llm_service():
+    """Create an LLM service whose requests are answered by a mock transport"""
+    service = LLMService()
+    
+    def respond_with(status_code, content):
+        service._client = httpx.AsyncClient(
+            base_url=service.base_url,
+            transport=httpx.MockTransport(lambda request: httpx.Response(status_code, content=content))
+        )
+        return service
+    
+    return respond_with
+
+class TestStreaming:
+    @pytest.mark.asyncio
+    async def test_stream_tokens(self, llm_service):
+        """Test that content deltas are yielded and other lines skipped"""
+        service = llm_service(200, stream_body(
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            "",
+            ": keep-alive",
+            'data: {"choices": [{"delta": {"content": "Hello"}}]}',
+            "",
+            'data: {"choices": []}',
+            'data: {"choices": [{"delta": {"content": " world"}}]}',
+            "data: [DONE]",
+            'data: {"choices": [{"delta": {"content": "ignored"}}]}'
+        ))
+        
+        tokens = [token async for token in service._stream_groq_api("prompt")]
+        
+        assert tokens == ["Hello", " world"]
+    
+    @pytest.mark.asyncio
+    async def test_stream_error_status(self, llm_service):
+        """Test that a non-200 response raises with the response body"""
+        service = llm_service(401, b'{"error": "invalid api key"}')
+        
+        with pytest.raises(Exception, match="Groq API error: 401 - .*invalid api key"):
+            [token async for token in service._stream_groq_api("prompt")]
+    
+    @pytest.mark.asyncio
+    async def test_generate_response_reports_errors(self, llm_service):
+        """Test that a failed completion becomes an apology instead of an exception"""
+        service = llm_service(429, b"rate limited")
+        
+        response = await service.generate_response("query", [{"content": "text", "filename": "a.txt"}])
+        
+        assert response.startswith("I apologize")
+        assert "429" in response
@@ -0,0 +1,324 @@
+import pytest
+import os
+import sys
+import pickle
+import zlib
+import numpy as np
+import orjson
+
+# Add the parent directory to sys.path to import the services
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from services import vector_store as vector_store_module
+from services.vector_store import VectorStore
+
+DIMENSION = 32
+
+class StubEncoder:
+    """Encoder that maps each text to a fixed pseudo-random unit vector"""
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True):
+        vectors = np.array([
+            np.random.default_rng(zlib.crc32(text.encode())).standard_normal(DIMENSION)
+            for text in texts
+        ], dtype=np.float32)
+        if normalize_embeddings and len(vectors):
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+@pytest.fixture
+def open_store(tmp_path, monkeypatch):
+    """Open vector stores on a temporary directory with a stub encoder"""
+    monkeypatch.setattr(vector_store_module, '_get_encoder', lambda model_name, device: StubEncoder())
+    monkeypatch.setattr(Config, 'VECTOR_STORE_PATH', str(tmp_path))
+    monkeypatch.setattr(Config, 'EMBEDDING_DIMENSION', DIMENSION)
+    monkeypatch.setattr(Config, 'EMBEDDING_DEVICE', 'cpu')
+    # Unrelated random vectors never come this close, so only exact matches pass
+    monkeypatch.setattr(Config, 'SIMILARITY_THRESHOLD', 0.99)
+
+    stores = []
+    def open_store():
+        store = VectorStore()
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+def make_chunks(document_id, texts):
+    """Create chunk dictionaries shaped like the document processor's"""
+    return [
+        {
+            'id': f"{document_id}_{i}",
+            'content': text,
+            'document_id': document_id,
+            'filename': f"{document_id}.txt",
+            'chunk_index': i,
+            'length': len(text),
+            'created_at': "2024-01-01T00:00:00"
+        }
+        for i, text in enumerate(texts)
+    ]
+
+def chunk_texts(document_id, count):
+    """Create distinct chunk texts for a document"""
+    return [f"{document_id} chunk {i}" for i in range(count)]
+
+class TestAddSearchDelete:
+    @pytest.mark.asyncio
+    async def test_add_and_search(self, open_store):
+        """Test that a stored chunk is found by its own text"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 3)))
+
+        results = await store.search("doc1 chunk 1", top_k=3)
+
+        assert [result['chunk_id'] for result in results] == ["doc1_1"]
+        assert results[0]['score'] == pytest.approx(1.0, abs=1e-5)
+        assert results[0]['embedding_index'] == 1
+        assert (await store.get_stats())['total_chunks'] == 3
+
+    @pytest.mark.asyncio
+    async def test_search_batch(self, open_store):
+        """Test that batched queries return the same hits as single searches"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 3)))
+
+        results = await store.search_batch(["doc1 chunk 0", "doc1 chunk 2", "unrelated"])
+
+        assert [[result['chunk_id'] for result in hits] for hits in results] == [["doc1_0"], ["doc1_2"], []]
+
+    @pytest.mark.asyncio
+    async def test_add_without_chunks(self, open_store):
+        """Test that a document without chunks leaves the store unchanged"""
+        store = open_store()
+        await store.add_documents("empty", [])
+
+        assert store.live_count == 0
+        assert await store.search("anything") == []
+
+    @pytest.mark.asyncio
+    async def test_delete_hides_chunks(self, open_store):
+        """Test that deleted chunks are no longer returned"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 2)))
+        await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 3)))
+
+        await store.delete_document("doc1")
+
+        assert await store.search("doc1 chunk 0") == []
+        assert [result['chunk_id'] for result in await store.search("doc2 chunk 0")] == ["doc2_0"]
+        assert store.get_document_chunks("doc1") == []
+        assert (await store.get_stats())['total_documents'] == 1
+
+    @pytest.mark.asyncio
+    async def test_search_after_compaction(self, open_store, tmp_path):
+        """Test that compaction renumbers the surviving rows consistently"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 3)))
+        await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 2)))
+
+        # Two of five rows stay live, which triggers compaction
+        await store.delete_document("doc1")
+
+        assert store.live_count == len(store.embeddings) == 2
+        assert (tmp_path / "embeddings.1.npy").exists()
+        assert not (tmp_path / "embeddings.npy").exists()
+        results = await store.search("doc2 chunk 1")
+        assert [result['chunk_id'] for result in results] == ["doc2_1"]
+        assert results[0]['embedding_index'] == 1
+        assert [chunk['embedding_index'] for chunk in store.get_document_chunks("doc2")] == [0, 1]
+
+class TestPersistence:
+    @pytest.mark.asyncio
+    async def test_reload_after_restart(self, open_store):
+        """Test that chunks and deletions survive a restart"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 2)))
+        await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 3)))
+        await store.delete_document("doc1")
+        store.close()
+
+        reloaded = open_store()
+
+        assert reloaded.live_count == 3
+        assert await reloaded.search("doc1 chunk 0") == []
+        assert [result['chunk_id'] for result in await reloaded.search("doc2 chunk 2")] == ["doc2_2"]
+
+        # New records continue after the reloaded ones
+        await reloaded.add_documents("doc3", make_chunks("doc3", chunk_texts("doc3", 1)))
+        assert [result['chunk_id'] for result in await reloaded.search("doc3 chunk 0")] == ["doc3_0"]
+
+    @pytest.mark.asyncio
+    async def test_reload_drops_uncommitted_rows(self, open_store, tmp_path):
+        """Test that rows beyond the header's row count are discarded on load"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 2)))
+        header = (tmp_path / "header.json").read_bytes()
+        await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 3)))
+        store.close()
+
+        # Restore the header from before the second insert, as if it crashed
+        # after writing rows and metadata but before committing them
+        (tmp_path / "header.json").write_bytes(header)
+        reloaded = open_store()
+
+        assert reloaded.live_count == 2
+        assert await reloaded.search("doc2 chunk 0") == []
+        assert reloaded.get_document_chunks("doc2") == []
+        assert [result['chunk_id'] for result in await reloaded.search("doc1 chunk 1")] == ["doc1_1"]
+
+    @pytest.mark.asyncio
+    async def test_reload_finishes_interrupted_compaction(self, open_store):
+        """Test that metadata left behind by a committed compaction is renumbered on load"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 3)))
+        await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 2)))
+
+        # Stop the compaction after its header commit, before the metadata update
+        store._renumber_metadata = lambda: None
+        await store.delete_document("doc1")
+        store.close()
+
+        reloaded = open_store()
+
+        assert reloaded.live_count == 2
+        assert [chunk['embedding_index'] for chunk in reloaded.get_document_chunks("doc2")] == [0, 1]
+        assert [result['chunk_id'] for result in await reloaded.search("doc2 chunk 1")] == ["doc2_1"]
+
+    @pytest.mark.asyncio
+    async def test_unreadable_index_is_dropped(self, open_store, tmp_path, monkeypatch):
+        """Test that a corrupt index file is discarded without losing chunks"""
+        monkeypatch.setattr(Config, 'ANN_INDEX_THRESHOLD', 4)
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 5)))
+        store.close()
+
+        (tmp_path / "index.faiss").write_bytes(b"not an index")
+        reloaded = open_store()
+
+        assert reloaded.live_count == 5
+        assert [result['chunk_id'] for result in await reloaded.search("doc1 chunk 3")] == ["doc1_3"]
+
+    @pytest.mark.asyncio
+    async def test_legacy_store_conversion(self, open_store, tmp_path):
+        """Test that a pickled store with JSON metadata is converted on first load"""
+        encoder = StubEncoder()
+        chunks = make_chunks("doc1", chunk_texts("doc1", 3))
+        # Older stores kept unnormalized embeddings as a pickled list of arrays
+        embeddings = [2.0 * vector for vector in encoder.encode([chunk['content'] for chunk in chunks])]
+        metadata = [
+            {
+                'chunk_id': chunk['id'],
+                'document_id': chunk['document_id'],
+                'filename': chunk['filename'],
+                'chunk_index': chunk['chunk_index'],
+                'content': chunk['content'],
+                'length': chunk['length'],
+                'created_at': chunk['created_at'],
+                'embedding_index': i
+            }
+            for i, chunk in enumerate(chunks)
+        ]
+        with open(tmp_path / "embeddings.pkl", 'wb') as f:
+            pickle.dump(embeddings, f)
+        (tmp_path / "metadata.json").write_bytes(orjson.dumps(metadata))
+
+        store = open_store()
+
+        assert orjson.loads((tmp_path / "header.json").read_bytes())['n_rows'] == 3
+        results = await store.search("doc1 chunk 2")
+        assert [result['chunk_id'] for result in results] == ["doc1_2"]
+        assert results[0]['score'] == pytest.approx(1.0, abs=1e-5)
+        assert [chunk['chunk_id'] for chunk in store.get_document_chunks("doc1")] == ["doc1_0", "doc1_1", "doc1_2"]
+
+class TestFailedWrites:
+    @pytest.mark.asyncio
+    async def test_failed_insert_is_rolled_back(self, open_store, monkeypatch):
+        """Test that an insert failing after its metadata commit leaves no trace"""
+        monkeypatch.setattr(vector_store_module, '_GROWTH_ROWS', 4)
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 3)))
+
+        # Growing the file for the second document fails, as on a full disk
+        def write_embeddings(embeddings, rows, path):
+            raise OSError("No space left on device")
+        store._write_embeddings = write_embeddings
+        with pytest.raises(OSError):
+            await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 3)))
+        del store._write_embeddings
+
+        await store.add_documents("doc3", make_chunks("doc3", chunk_texts("doc3", 2)))
+
+        assert store.live_count == 5
+        assert (await store.get_stats())['total_documents'] == 2
+        assert await store.search("doc2 chunk 0") == []
+        assert [chunk['embedding_index'] for chunk in store.get_document_chunks("doc3")] == [3, 4]
+        assert [result['chunk_id'] for result in await store.search("doc3 chunk 1")] == ["doc3_1"]
+        store.close()
+
+        reloaded = open_store()
+        assert reloaded.live_count == 5
+        assert reloaded.get_document_chunks("doc2") == []
+        assert [result['chunk_id'] for result in await reloaded.search("doc3 chunk 0")] == ["doc3_0"]
+
+        # Compaction renumbers by rank, which only holds without leftover records
+        await reloaded.delete_document("doc1")
+        assert [chunk['embedding_index'] for chunk in reloaded.get_document_chunks("doc3")] == [0, 1]
+        assert [result['chunk_id'] for result in await reloaded.search("doc3 chunk 1")] == ["doc3_1"]
+
+    @pytest.mark.asyncio
+    async def test_failed_compaction_keeps_store(self, open_store, tmp_path):
+        """Test that a compaction failing before its header commit leaves the store as it was"""
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 3)))
+        await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 2)))
+
+        def write_embeddings(embeddings, rows, path):
+            raise OSError("No space left on device")
+        store._write_embeddings = write_embeddings
+        with pytest.raises(OSError):
+            await store.delete_document("doc1")
+        del store._write_embeddings
+
+        # The deletion itself was recorded before compacting
+        assert store._generation == 0
+        assert len(store.embeddings) == 5 and store.live_count == 2
+        assert await store.search("doc1 chunk 0") == []
+        assert [result['chunk_id'] for result in await store.search("doc2 chunk 1")] == ["doc2_1"]
+        store.close()
+
+        reloaded = open_store()
+        assert orjson.loads((tmp_path / "header.json").read_bytes())['generation'] == 0
+        assert reloaded.live_count == 2
+        assert [result['chunk_id'] for result in await reloaded.search("doc2 chunk 0")] == ["doc2_0"]
+
+class TestIndexSearch:
+    @pytest.mark.asyncio
+    async def test_search_through_index(self, open_store, tmp_path, monkeypatch):
+        """Test that large stores are searched through the HNSW index and kept in step"""
+        monkeypatch.setattr(Config, 'ANN_INDEX_THRESHOLD', 20)
+        store = open_store()
+        await store.add_documents("doc1", make_chunks("doc1", chunk_texts("doc1", 30)))
+
+        results = await store.search("doc1 chunk 17", top_k=3)
+
+        assert store._index is not None
+        assert (tmp_path / "index.faiss").exists()
+        assert [result['chunk_id'] for result in results] == ["doc1_17"]
+
+        # Rows added after the build go into the existing index
+        await store.add_documents("doc2", make_chunks("doc2", chunk_texts("doc2", 5)))
+        assert store._index.ntotal == 35
+        assert [result['chunk_id'] for result in await store.search("doc2 chunk 4")] == ["doc2_4"]
+
+        # Deleted rows stay in the index but are never returned
+        await store.delete_document("doc2")
+        assert await store.search("doc2 chunk 4") == []
+        store.close()
+
+        # The saved index is caught up with rows added since it was written
+        reloaded = open_store()
+        assert reloaded._index is not None and reloaded._index.ntotal == 35
+        assert [result['chunk_id'] for result in await reloaded.search("doc1 chunk 29")] == ["doc1_29"]